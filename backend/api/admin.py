@@ -1,20 +1,157 @@
+from collections import Counter
+
 from django.contrib import admin
+from django.contrib.admin.widgets import AutocompleteSelect
+from django.core.paginator import Paginator
+from django.db import connections
+from django.forms.models import BaseInlineFormSet
+from django.utils.functional import cached_property
 
 from api.models import Recipes, Tags, Ingredient, FavoriteUser, ShopCart, \
-    IngredientForRecipe
+    IngredientForRecipe, ShoppingListItem
+from api.shopping_list import apply_recipe_change, rebuild
+from api.signals import touch_recipes
 
 
-class FavoriteUserAdmin(admin.ModelAdmin):
-    list_display = ('user', 'recipes')
+class EstimatedCountPaginator(Paginator):
+    """Для больших таблиц без фильтров берёт оценку числа строк PostgreSQL
+
+    COUNT(*) по всей таблице на сотнях тысяч строк занимает секунды, а для
+    страницы списка в админке точное число не нужно. Отфильтрованные
+    списки и таблицы меньше EXACT_LIMIT считаются точно.
+    """
+    EXACT_LIMIT = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor == 'postgresql' and not queryset.query.where:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT reltuples FROM pg_class WHERE relname = %s',
+                    [queryset.model._meta.db_table]
+                )
+                row = cursor.fetchone()
+            if row and row[0] >= self.EXACT_LIMIT:
+                return int(row[0])
+        return super().count
+
 
+def rebuild_carts(recipe_ids):
+    """Пересобирает списки покупок у всех, у кого рецепты в корзине"""
+    rebuild(ShopCart.objects.filter(
+        recipes__in=recipe_ids
+    ).values_list('user_id', flat=True))
 
-class RecipesAdmin(admin.ModelAdmin):
-    list_display = ('id', 'author', 'name')
-    search_fields = ('author', 'name', 'tags')
-    list_filter = ('author', 'name', 'tags')
+
+def rows_changed(recipe_ids):
+    """Строки рецептов правились напрямую, без сохранения самих рецептов"""
+    touch_recipes(set(recipe_ids))
+    rebuild_carts(recipe_ids)
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """Настройки списка для таблиц, которые растут вместе с пользователями"""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     empty_value_display = '-пусто-'
 
 
+class LabeledAutocompleteSelect(AutocompleteSelect):
+    """Автокомплит, который берёт подпись выбранного значения из labels
+
+    Обычный AutocompleteSelect делает запрос за подписью в каждой строке
+    инлайна, здесь подписи заранее заполняет формсет.
+    """
+    labels = None
+
+    def optgroups(self, name, value, attr=None):
+        selected = {str(item) for item in value if item not in (None, '')}
+        if self.labels is None or not selected <= self.labels.keys():
+            return super().optgroups(name, value, attr)
+        groups = [(None, [], 0)]
+        if not self.is_required:
+            groups[0][1].append(self.create_option(name, '', '', False, 0))
+        for index, pk in enumerate(sorted(selected), start=1):
+            groups.append((None, [self.create_option(
+                name, pk, self.labels[pk], True, index
+            )], index))
+        return groups
+
+
+class IngredientForRecipeFormSet(BaseInlineFormSet):
+    def amount_deltas(self):
+        """Изменение количеств по ингредиентам только из изменённых строк"""
+        deltas = Counter()
+        deleted = self.deleted_forms
+        for form in self.forms:
+            if form not in deleted and not form.has_changed():
+                continue
+            if form.instance.pk is not None:
+                deltas[form.initial['ingredients']] -= form.initial['amount']
+            if form not in deleted and form.cleaned_data:
+                deltas[form.cleaned_data['ingredients'].pk] += \
+                    form.cleaned_data['amount']
+        return deltas
+
+    def _construct_form(self, i, **kwargs):
+        form = super()._construct_form(i, **kwargs)
+        widget = form.fields['ingredients'].widget
+        widget = getattr(widget, 'widget', widget)
+        if form.instance.ingredients_id is not None:
+            widget.labels = {str(form.instance.ingredients_id):
+                             str(form.instance.ingredients)}
+        return form
+
+
+class IngredientForRecipeInline(admin.TabularInline):
+    model = IngredientForRecipe
+    formset = IngredientForRecipeFormSet
+    extra = 1
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('ingredients')
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        if db_field.name == 'ingredients':
+            kwargs['widget'] = LabeledAutocompleteSelect(
+                db_field.remote_field, self.admin_site,
+                using=kwargs.get('using')
+            )
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
+
+
+class FavoriteUserAdmin(LargeTableAdmin):
+    list_display = ('user', 'recipes')
+    list_select_related = ('user', 'recipes')
+    autocomplete_fields = ('user', 'recipes')
+    search_fields = ('user__username', 'user__email', 'recipes__name')
+
+
+class RecipesAdmin(LargeTableAdmin):
+    list_display = ('id', 'author', 'name', 'favorites_count',
+                    'in_carts_count', 'pub_date')
+    list_select_related = ('author',)
+    search_fields = ('name', 'author__username', 'author__email')
+    list_filter = ('tags',)
+    autocomplete_fields = ('author', 'tags')
+    readonly_fields = ('favorites_count', 'in_carts_count')
+    inlines = (IngredientForRecipeInline,)
+
+    def save_related(self, request, form, formsets, change):
+        """Списки покупок получают только разницу изменённых строк"""
+        deltas = Counter()
+        if change:
+            for formset in formsets:
+                if isinstance(formset, IngredientForRecipeFormSet) \
+                        and formset.has_changed():
+                    deltas.update(formset.amount_deltas())
+        super().save_related(request, form, formsets, change)
+        if deltas:
+            apply_recipe_change(form.instance.pk, deltas)
+
+
 class TagAdmin(admin.ModelAdmin):
     list_display = ('id', 'name', 'color')
     search_fields = ('name',)
@@ -22,23 +159,49 @@ class TagAdmin(admin.ModelAdmin):
     empty_value_display = '-пусто-'
 
 
-class IngredientAdmin(admin.ModelAdmin):
-    list_display = ('name',)
-    search_fields = ('name',)
-    list_filter = ('name',)
-    empty_value_display = '-пусто-'
+class IngredientAdmin(LargeTableAdmin):
+    list_display = ('name', 'measurement_unit')
+    search_fields = ('^name',)
+    list_filter = ('measurement_unit',)
 
 
-class ShopCartAdmin(admin.ModelAdmin):
+class ShopCartAdmin(LargeTableAdmin):
     list_display = ('user', 'recipes')
-    search_fields = ('user',)
-    list_filter = ('user',)
-    empty_value_display = '-пусто-'
+    list_select_related = ('user', 'recipes')
+    autocomplete_fields = ('user', 'recipes')
+    search_fields = ('user__username', 'user__email', 'recipes__name')
 
 
-class IngredientForRecipeAdmin(admin.ModelAdmin):
+class IngredientForRecipeAdmin(LargeTableAdmin):
+    """Правка строк рецептов напрямую, списки покупок пересобираются"""
     list_display = ('recipe', 'ingredients', 'amount')
-    empty_value_display = '-пусто-'
+    list_select_related = ('recipe', 'ingredients')
+    raw_id_fields = ('recipe',)
+    autocomplete_fields = ('ingredients',)
+    search_fields = ('recipe__name',)
+
+    def save_model(self, request, obj, form, change):
+        recipe_ids = {obj.recipe_id}
+        if change and 'recipe' in form.changed_data:
+            recipe_ids.add(form.initial['recipe'])
+        super().save_model(request, obj, form, change)
+        rows_changed(recipe_ids)
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        rows_changed([obj.recipe_id])
+
+    def delete_queryset(self, request, queryset):
+        recipe_ids = list(queryset.values_list('recipe_id', flat=True))
+        super().delete_queryset(request, queryset)
+        rows_changed(recipe_ids)
+
+
+class ShoppingListItemAdmin(LargeTableAdmin):
+    list_display = ('user', 'ingredient', 'amount')
+    list_select_related = ('user', 'ingredient')
+    raw_id_fields = ('user', 'ingredient')
+    search_fields = ('user__username', 'user__email')
 
 
 admin.site.register(Recipes, RecipesAdmin)
@@ -47,3 +210,4 @@ admin.site.register(Ingredient, IngredientAdmin)
 admin.site.register(FavoriteUser, FavoriteUserAdmin)
 admin.site.register(ShopCart, ShopCartAdmin)
 admin.site.register(IngredientForRecipe, IngredientForRecipeAdmin)
+admin.site.register(ShoppingListItem, ShoppingListItemAdmin)
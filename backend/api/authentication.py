@@ -0,0 +1,111 @@
+import copy
+import hashlib
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+
+from .cache import bump_version, get_version
+
+NAMESPACE = 'auth'
+
+
+def token_namespace(key):
+    """Пространство имён версии кеша одного токена"""
+    return f'{NAMESPACE}:{hashlib.md5(key.encode()).hexdigest()}'
+
+
+def invalidate_token(key):
+    bump_version(token_namespace(key))
+
+
+class LRUCache:
+    """Потокобезопасный LRU с временем жизни записей"""
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            item = self.items.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires < time.monotonic():
+                del self.items[key]
+                return None
+            self.items.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.items[key] = (time.monotonic() + self.ttl, value)
+            self.items.move_to_end(key)
+            while len(self.items) > self.size:
+                self.items.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication без запроса к БД на каждый запрос
+
+    Пара токен -> пользователь хранится в LRU процесса и в общем кеше под
+    версией этого токена. Выход, смена пароля, деактивация или удаление
+    пользователя меняют версию его токена (см. signals), остальные токены
+    остаются в кеше.
+
+    Закешированный пользователь может отставать на TOKEN_CACHE_TTL. Счётчики
+    пользователя save() не пишет (DenormalizedFieldsMixin), а действия,
+    которые сохраняют саму строку пользователя, берут его свежим через
+    fresh_user (см. CreateUserView).
+    """
+    local = LRUCache(settings.TOKEN_CACHE_SIZE, settings.TOKEN_CACHE_TTL)
+    stats = Counter()
+
+    def authenticate(self, request):
+        self.source = None
+        result = super().authenticate(request)
+        request._request.auth_cache = self.source
+        return result
+
+    @staticmethod
+    def fresh_user(pk):
+        user = get_user_model()._default_manager.filter(
+            pk=pk, is_active=True
+        ).first()
+        if user is None:
+            raise exceptions.AuthenticationFailed(
+                'Пользователь неактивен или удалён.'
+            )
+        return user
+
+    def authenticate_credentials(self, key):
+        self.source = 'miss'
+        namespace = token_namespace(key)
+        shared_key = f'{namespace}:{get_version(namespace)}'
+        cached = self.local.get(shared_key)
+        if cached is not None:
+            self.source = 'local'
+        else:
+            cached = cache.get(shared_key)
+            if cached is not None:
+                self.source = 'shared'
+                self.local.set(shared_key, cached)
+        self.stats[self.source] += 1
+        if cached is None:
+            cached = super().authenticate_credentials(key)
+            cache.set(shared_key, cached, settings.TOKEN_CACHE_TTL)
+            self.local.set(shared_key, cached)
+        user, token = cached
+        return copy.copy(user), token
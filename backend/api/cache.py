@@ -0,0 +1,135 @@
+import hashlib
+import time
+from functools import partial
+
+from django.core.cache import cache
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+
+from .renderers import ORJSONRenderer
+from .replicas import read_from_replica
+
+CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def version_key(namespace):
+    return f'{namespace}:version'
+
+
+def get_version(namespace):
+    """Текущая версия данных пространства имён кеша"""
+    return cache.get_or_set(version_key(namespace), time.time_ns, None)
+
+
+def bump_version(namespace):
+    """Инвалидирует все записи пространства имён сменой версии"""
+    try:
+        cache.incr(version_key(namespace))
+    except ValueError:
+        cache.set(version_key(namespace), time.time_ns(), None)
+
+
+def normalized_query(request, params=None):
+    """Строка запроса с отсортированными параметрами и значениями
+
+    Если передан params, учитываются только перечисленные параметры.
+    """
+    pairs = sorted(
+        (name, value)
+        for name, values in request.query_params.lists()
+        if params is None or name in params
+        for value in set(values)
+    )
+    return '&'.join(f'{name}={value}' for name, value in pairs)
+
+
+def make_key(namespace, request, params=None):
+    digest = hashlib.md5(
+        normalized_query(request, params).encode()
+    ).hexdigest()
+    return (f'{namespace}:{get_version(namespace)}:{request.get_host()}'
+            f'{request.path}:{digest}')
+
+
+def make_etag(data):
+    return '"%s"' % hashlib.md5(ORJSONRenderer().render(data)).hexdigest()
+
+
+def etag_matches(request, etag):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if not if_none_match:
+        return False
+    etags = parse_etags(if_none_match)
+    return '*' in etags or etag in etags
+
+
+def cached_response(request, key, build):
+    """Ответ из кеша по key или из build() с последующим сохранением
+
+    build() читает с основной базы: реплика сразу после сброса версии может
+    отдать старые данные, и они пролежали бы в общем кеше CACHE_TIMEOUT.
+    """
+    cached = cache.get(key)
+    if cached is None:
+        with read_from_replica(False):
+            response = build()
+        if response.status_code != status.HTTP_200_OK:
+            return response
+        cached = {'etag': make_etag(response.data),
+                  'data': response.data}
+        cache.set(key, cached, CACHE_TIMEOUT)
+    if etag_matches(request, cached['etag']):
+        response = Response(status=status.HTTP_304_NOT_MODIFIED)
+    else:
+        response = Response(cached['data'])
+    response['ETag'] = cached['etag']
+    return response
+
+
+class CachedListMixin:
+    """Кеширует список версионированно и отвечает 304 по ETag"""
+    cache_namespace = None
+
+    def list(self, request, *args, **kwargs):
+        build = partial(super().list, request, *args, **kwargs)
+        return cached_response(
+            request, make_key(self.cache_namespace, request), build
+        )
+
+
+class AnonymousCacheMixin:
+    """Кеширует list и retrieve для анонимных пользователей
+
+    Список хранится под версией пространства имён cache_namespace,
+    объект - под своей версией cache_namespace:pk и общей версией
+    cache_namespace-deps для связанных данных (теги, ингредиенты, авторы).
+    """
+    cache_namespace = None
+    cache_params = None
+
+    def item_key(self, request, pk):
+        namespace = self.cache_namespace
+        digest = hashlib.md5(
+            normalized_query(request, self.cache_params).encode()
+        ).hexdigest()
+        return (f'{namespace}-item:{pk}:{get_version(f"{namespace}:{pk}")}:'
+                f'{get_version(f"{namespace}-deps")}:{request.get_host()}:'
+                f'{digest}')
+
+    def list(self, request, *args, **kwargs):
+        build = partial(super().list, request, *args, **kwargs)
+        if not request.user.is_anonymous:
+            return build()
+        return cached_response(
+            request,
+            make_key(self.cache_namespace, request, self.cache_params),
+            build
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        build = partial(super().retrieve, request, *args, **kwargs)
+        pk = kwargs.get(self.lookup_url_kwarg or self.lookup_field)
+        if not request.user.is_anonymous or not str(pk).isdigit():
+            return build()
+        return cached_response(request, self.item_key(request, pk), build)
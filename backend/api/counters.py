@@ -0,0 +1,46 @@
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from users.models import Follow, User
+from .models import FavoriteUser, Recipes, ShopCart
+
+COUNTERS = (
+    (Recipes, 'favorites_count', FavoriteUser, 'recipes'),
+    (Recipes, 'in_carts_count', ShopCart, 'recipes'),
+    (User, 'recipes_count', Recipes, 'author'),
+    (User, 'followers_count', Follow, 'author'),
+)
+
+
+def change_counter(model, pk, field, delta):
+    """Атомарно меняет счётчик, не опуская его ниже нуля"""
+    queryset = model.objects.filter(pk=pk)
+    if delta < 0:
+        queryset = queryset.filter(**{f'{field}__gte': -delta})
+    queryset.update(**{field: F(field) + delta})
+
+
+def change_counters(model, pks, field, delta):
+    """change_counter для нескольких объектов одним UPDATE"""
+    queryset = model.objects.filter(pk__in=pks)
+    if delta < 0:
+        queryset = queryset.filter(**{f'{field}__gte': -delta})
+    queryset.update(**{field: F(field) + delta})
+
+
+def actual_count(related, fk):
+    counts = related.objects.filter(**{fk: OuterRef('pk')}).order_by(
+    ).values(fk).annotate(total=Count('pk')).values('total')
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+
+def recompute_counters():
+    """Пересчитывает все счётчики, возвращает число расхождений по каждому"""
+    drift = {}
+    for model, field, related, fk in COUNTERS:
+        expression = actual_count(related, fk)
+        drift[f'{model.__name__}.{field}'] = model.objects.annotate(
+            actual=expression
+        ).exclude(**{field: F('actual')}).count()
+        model.objects.update(**{field: expression})
+    return drift
@@ -0,0 +1,173 @@
+import heapq
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+
+from users.models import Follow, User
+from .models import Recipes, TimelineEntry
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 5000
+
+executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='feed-fanout')
+
+
+def fanout_threshold():
+    """Порог подписчиков для раскладки при записи, None если выключено"""
+    return settings.FEED_FANOUT_THRESHOLD or None
+
+
+def older_than(position, date_field, id_field):
+    """Условие «строго после курсора» для сортировки (-pub_date, -id)"""
+    if position is None:
+        return Q()
+    pub_date, pk = position
+    return (Q(**{f'{date_field}__lt': pub_date})
+            | Q(**{date_field: pub_date, f'{id_field}__lt': pk}))
+
+
+def feed_keys(user, position, limit):
+    """Ключи (pub_date, id) следующих limit рецептов ленты пользователя
+
+    Рецепты авторов с User.feed_fanout берутся из готовой ленты
+    TimelineEntry, остальных - соединением Follow с Recipes по индексу
+    (author, -pub_date, -id). Флаг ставится только после того, как ленты
+    всех подписчиков заполнены, поэтому автор, только что перешедший порог,
+    до этого момента читается соединением. Оба источника ограничены limit и
+    сливаются по дате.
+    """
+    threshold = fanout_threshold()
+    joined = Recipes.objects.filter(author__following__user=user)
+    if threshold is not None:
+        joined = joined.filter(author__feed_fanout=False)
+    sources = [joined.filter(
+        older_than(position, 'pub_date', 'id')
+    ).order_by('-pub_date', '-id').values_list('pub_date', 'id')[:limit]]
+    if threshold is not None:
+        sources.append(TimelineEntry.objects.filter(
+            older_than(position, 'pub_date', 'recipe_id'), user=user
+        ).order_by('-pub_date', '-recipe').values_list(
+            'pub_date', 'recipe_id'
+        )[:limit])
+    keys, seen = [], set()
+    for key in heapq.merge(*map(list, sources), reverse=True):
+        if key[1] not in seen:
+            seen.add(key[1])
+            keys.append(key)
+        if len(keys) == limit:
+            break
+    return keys
+
+
+def fill_timelines(recipes, user_ids):
+    """Добавляет рецепты в ленты пользователей пачками"""
+    entries = (TimelineEntry(user_id=user_id, recipe_id=pk, pub_date=pub_date)
+               for pk, pub_date in recipes for user_id in user_ids)
+    batch = []
+    for entry in entries:
+        batch.append(entry)
+        if len(batch) >= BATCH_SIZE:
+            TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+def is_popular(author_id):
+    """Рецепты автора раскладываются: флаг уже стоит или порог пройден"""
+    threshold = fanout_threshold()
+    return threshold is not None and User.objects.filter(
+        Q(feed_fanout=True) | Q(followers_count__gte=threshold),
+        pk=author_id
+    ).exists()
+
+
+def followers(author_id):
+    return list(Follow.objects.filter(
+        author_id=author_id
+    ).values_list('user_id', flat=True))
+
+
+def fan_out_recipe(recipe_id):
+    """Раскладывает новый рецепт популярного автора по лентам подписчиков"""
+    recipe = Recipes.objects.filter(pk=recipe_id).values(
+        'author_id', 'pub_date'
+    ).first()
+    if recipe is None or not is_popular(recipe['author_id']):
+        return
+    fill_timelines([(recipe_id, recipe['pub_date'])],
+                   followers(recipe['author_id']))
+
+
+def backfill(author_id, user_ids=None):
+    """Кладёт последние рецепты автора в ленты его подписчиков"""
+    if not is_popular(author_id):
+        return
+    if user_ids is None:
+        user_ids = followers(author_id)
+    recipes = Recipes.objects.filter(author_id=author_id).order_by(
+        '-pub_date', '-id'
+    ).values_list('id', 'pub_date')[:settings.FEED_TIMELINE_DEPTH]
+    fill_timelines(list(recipes), user_ids)
+
+
+def start_fanout(author_id):
+    """Заполняет ленты всех подписчиков и только потом ставит флаг"""
+    backfill(author_id)
+    User.objects.filter(pk=author_id).update(feed_fanout=True)
+
+
+def follow_added(user_id, author_id):
+    """Новый подписчик получает ленту раскладываемого автора, а автор,
+    дошедший до порога, раскладывается всем подписчикам"""
+    author = User.objects.filter(pk=author_id).values(
+        'feed_fanout', 'followers_count'
+    ).first()
+    if author is None:
+        return
+    if author['feed_fanout']:
+        backfill(author_id, [user_id])
+    elif author['followers_count'] >= fanout_threshold():
+        start_fanout(author_id)
+
+
+def follow_removed(user_id, author_id):
+    TimelineEntry.objects.filter(
+        user_id=user_id, recipe__author_id=author_id
+    ).delete()
+
+
+def rebuild_timelines():
+    """Собирает ленты заново по текущим подпискам и порогу"""
+    User.objects.filter(feed_fanout=True).update(feed_fanout=False)
+    TimelineEntry.objects.all().delete()
+    threshold = fanout_threshold()
+    if threshold is None:
+        return 0
+    authors = list(User.objects.filter(
+        followers_count__gte=threshold
+    ).values_list('pk', flat=True))
+    for author_id in authors:
+        start_fanout(author_id)
+    return len(authors)
+
+
+def run(func, *args):
+    close_old_connections()
+    try:
+        func(*args)
+    except Exception:
+        logger.exception('Не удалось обновить ленты: %s%s',
+                         func.__name__, args)
+    finally:
+        close_old_connections()
+
+
+def schedule(func, *args):
+    """Выполняет func в фоновом потоке после коммита транзакции"""
+    if fanout_threshold() is None:
+        return
+    transaction.on_commit(lambda: executor.submit(run, func, *args))
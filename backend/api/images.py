@@ -0,0 +1,154 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+from PIL import Image
+
+from .cache import bump_version
+from .models import Recipes
+
+logger = logging.getLogger(__name__)
+
+VARIANTS = {
+    'thumbnail': (160, 160),
+    'card': (480, 480),
+    'full': (1200, 1200),
+}
+FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 85, 'optimize': True, 'progressive': True}),
+}
+VARIANTS_DIR = 'variants'
+
+executor = ThreadPoolExecutor(
+    max_workers=settings.IMAGE_VARIANT_WORKERS,
+    thread_name_prefix='image-variants'
+)
+
+
+def variant_name(name, variant, extension):
+    """image/cake.png -> image/variants/cake_card.webp"""
+    directory, filename = os.path.split(name)
+    stem = os.path.splitext(filename)[0]
+    return os.path.join(directory, VARIANTS_DIR,
+                        f'{stem}_{variant}.{extension}')
+
+
+def variant_urls(recipe, request=None):
+    """Ссылки на уменьшенные копии картинки рецепта, если они уже созданы
+
+    Готовность хранится в Recipes.variants_image, хранилище не опрашивается.
+    С request ссылки абсолютные, как у поля image в DRF.
+    """
+    if not recipe.image or recipe.variants_image != recipe.image.name:
+        return None
+    urls = {}
+    for variant in VARIANTS:
+        urls[variant] = {}
+        for extension in FORMATS:
+            url = default_storage.url(
+                variant_name(recipe.image.name, variant, extension)
+            )
+            if request is not None:
+                url = request.build_absolute_uri(url)
+            urls[variant][extension] = url
+    return urls
+
+
+def generate_variants(name, force=False):
+    """Создаёт все варианты картинки, уже готовые пропускает"""
+    targets = [(variant, extension, variant_name(name, variant, extension))
+               for variant in VARIANTS for extension in FORMATS]
+    if not force:
+        targets = [target for target in targets
+                   if not default_storage.exists(target[2])]
+    if not targets:
+        return 0
+    with default_storage.open(name) as file:
+        original = Image.open(file)
+        original.load()
+    if original.mode not in ('RGB', 'RGBA'):
+        original = original.convert('RGBA')
+    for variant, extension, target in targets:
+        image = original.copy()
+        image.thumbnail(VARIANTS[variant], Image.LANCZOS)
+        image_format, options = FORMATS[extension]
+        if image_format == 'JPEG' and image.mode != 'RGB':
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+        buffer = BytesIO()
+        image.save(buffer, image_format, **options)
+        if default_storage.exists(target):
+            default_storage.delete(target)
+        default_storage.save(target, ContentFile(buffer.getvalue()))
+    return len(targets)
+
+
+def delete_variants(name):
+    for variant in VARIANTS:
+        for extension in FORMATS:
+            default_storage.delete(variant_name(name, variant, extension))
+
+
+def is_used(name):
+    return Recipes.objects.filter(
+        Q(image=name) | Q(variants_image=name)
+    ).exists()
+
+
+def mark_ready(recipes, name):
+    """Отмечает варианты name готовыми и сбрасывает кеш этих рецептов"""
+    pks = list(recipes.values_list('pk', flat=True))
+    if not Recipes.objects.filter(pk__in=pks, image=name).update(
+            variants_image=name, updated_at=timezone.now()):
+        return False
+    for namespace in ('recipes', *(f'recipes:{pk}' for pk in pks)):
+        bump_version(namespace)
+    return True
+
+
+def refresh_variants(recipe_id):
+    """Создаёт варианты текущей картинки рецепта и удаляет варианты
+    прежней, если она больше нигде не используется"""
+    recipe = Recipes.objects.filter(pk=recipe_id).values(
+        'image', 'variants_image'
+    ).first()
+    if recipe is None or recipe['image'] == recipe['variants_image']:
+        return
+    name, previous = recipe['image'], recipe['variants_image']
+    if name:
+        generate_variants(name)
+    # картинку успели сменить - прежние варианты удалит следующая задача
+    if not mark_ready(Recipes.objects.filter(pk=recipe_id), name):
+        return
+    if previous and not is_used(previous):
+        delete_variants(previous)
+
+
+def remove_variants(name):
+    if not is_used(name):
+        delete_variants(name)
+
+
+def run(func, *args):
+    close_old_connections()
+    try:
+        func(*args)
+    except Exception:
+        logger.exception('Не удалось обработать картинку: %s%s',
+                         func.__name__, args)
+    finally:
+        close_old_connections()
+
+
+def schedule_variants(func, *args):
+    """Ставит обработку картинки в фоновый пул после коммита транзакции"""
+    transaction.on_commit(lambda: executor.submit(run, func, *args))
@@ -0,0 +1,59 @@
+from bisect import bisect_left
+from threading import Lock
+
+from .cache import get_version
+from .models import Ingredient
+from .replicas import read_from_replica
+
+
+class IngredientPrefixIndex:
+    """Отсортированный по имени список ингредиентов для поиска по префиксу
+
+    Индекс живёт в памяти процесса и перестраивается, когда меняется
+    версия кеша ингредиентов, то есть после любой записи в Ingredient.
+    Строится по основной базе, чтобы не застрять на отставшей реплике до
+    следующей записи.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._version = None
+        self._keys = []
+        self._items = []
+
+    def build(self, version=None):
+        with read_from_replica(False):
+            rows = sorted(
+                (name.lower(), pk, name, measurement_unit)
+                for pk, name, measurement_unit
+                in Ingredient.objects.values_list(
+                    'id', 'name', 'measurement_unit'
+                ).order_by()
+            )
+        self._keys = [row[0] for row in rows]
+        self._items = [
+            {'id': pk, 'name': name, 'measurement_unit': measurement_unit}
+            for _, pk, name, measurement_unit in rows
+        ]
+        self._version = version
+
+    def refresh(self):
+        version = get_version('ingredients')
+        if version != self._version:
+            with self._lock:
+                if version != self._version:
+                    self.build(version)
+
+    def search(self, prefix, limit=None):
+        self.refresh()
+        keys, items = self._keys, self._items
+        prefix = prefix.lower()
+        start = bisect_left(keys, prefix)
+        end = start
+        stop = len(keys) if limit is None else min(len(keys), start + limit)
+        while end < stop and keys[end].startswith(prefix):
+            end += 1
+        return items[start:end]
+
+
+ingredient_index = IngredientPrefixIndex()
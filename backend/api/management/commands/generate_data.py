@@ -0,0 +1,145 @@
+import random
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.cache import bump_version
+from api.counters import recompute_counters
+from api.feed import rebuild_timelines
+from api.models import (FavoriteUser, Ingredient, IngredientForRecipe,
+                        Recipes, ShopCart, Tags)
+from api.shopping_list import rebuild
+from users.models import Follow, User
+
+BATCH_SIZE = 5000
+WORDS = (
+    'борщ', 'пирог', 'салат', 'суп', 'рагу', 'паста', 'омлет', 'каша',
+    'запеканка', 'котлеты', 'блины', 'плов', 'соус', 'хлеб', 'десерт',
+)
+
+
+def bulk_create_returning(model, objects):
+    """bulk_create, который возвращает объекты с pk и на SQLite"""
+    created = model.objects.bulk_create(objects)
+    if not created or created[0].pk is not None:
+        return created
+    return list(model.objects.order_by('-id')[:len(created)])[::-1]
+
+
+def batches(total):
+    for start in range(0, total, BATCH_SIZE):
+        yield start, min(BATCH_SIZE, total - start)
+
+
+class Command(BaseCommand):
+    help = 'Наполняет базу синтетическими данными для нагрузочных тестов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--recipes', type=int, default=10000)
+        parser.add_argument('--tags', type=int, default=10)
+        parser.add_argument('--ingredients', type=int, default=500,
+                            help='Создаётся, только если каталог меньше')
+        parser.add_argument('--ingredients-per-recipe', type=int, default=8)
+        parser.add_argument('--tags-per-recipe', type=int, default=2)
+        parser.add_argument('--follows-per-user', type=int, default=20)
+        parser.add_argument('--favorites-per-user', type=int, default=30)
+        parser.add_argument('--cart-per-user', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=None)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        with transaction.atomic():
+            users = self.create_users(options['users'])
+            tags = self.create_tags(options['tags'])
+            ingredients = self.create_ingredients(options['ingredients'])
+        recipes = self.create_recipes(rng, options, users, tags, ingredients)
+        self.create_relations(rng, options, users, recipes)
+        recompute_counters()
+        rebuild(users)
+        rebuild_timelines()
+        for namespace in ('tags', 'ingredients', 'recipes', 'recipes-deps'):
+            bump_version(namespace)
+        self.stdout.write(self.style.SUCCESS(
+            f'Пользователей: {len(users)}, рецептов: {len(recipes)}'
+        ))
+
+    @staticmethod
+    def create_users(total):
+        offset = User.objects.count()
+        users = bulk_create_returning(User, [
+            User(username=f'bench{i}', email=f'bench{i}@example.com',
+                 first_name='Bench', last_name=f'User{i}')
+            for i in range(offset, offset + total)
+        ])
+        return [user.pk for user in users]
+
+    @staticmethod
+    def create_tags(total):
+        existing = Tags.objects.count()
+        if existing < total:
+            Tags.objects.bulk_create([
+                Tags(name=f'bench{i}', slug=f'bench{i}')
+                for i in range(existing, total)
+            ], ignore_conflicts=True)
+        return list(Tags.objects.values_list('id', flat=True))
+
+    @staticmethod
+    def create_ingredients(total):
+        existing = Ingredient.objects.count()
+        if existing < total:
+            Ingredient.objects.bulk_create([
+                Ingredient(name=f'bench{i}', measurement_unit='г')
+                for i in range(existing, total)
+            ], ignore_conflicts=True)
+        return list(Ingredient.objects.values_list('id', flat=True))
+
+    @staticmethod
+    def create_recipes(rng, options, users, tags, ingredients):
+        tag_through = Recipes.tags.through
+        tags_per_recipe = min(options['tags_per_recipe'], len(tags))
+        items_per_recipe = min(options['ingredients_per_recipe'],
+                               len(ingredients))
+        recipe_ids = []
+        for start, size in batches(options['recipes']):
+            with transaction.atomic():
+                recipes = bulk_create_returning(Recipes, [
+                    Recipes(author_id=rng.choice(users),
+                            name=f'{rng.choice(WORDS)} {start + i}',
+                            image='image/bench.jpg',
+                            text=' '.join(rng.choices(WORDS, k=30)),
+                            cooking_time=rng.randint(1, 200))
+                    for i in range(size)
+                ])
+                tag_through.objects.bulk_create([
+                    tag_through(recipes_id=recipe.pk, tags_id=tag)
+                    for recipe in recipes
+                    for tag in rng.sample(tags, tags_per_recipe)
+                ])
+                IngredientForRecipe.objects.bulk_create([
+                    IngredientForRecipe(recipe_id=recipe.pk,
+                                        ingredients_id=item,
+                                        amount=rng.randint(1, 500))
+                    for recipe in recipes
+                    for item in rng.sample(ingredients, items_per_recipe)
+                ])
+            recipe_ids.extend(recipe.pk for recipe in recipes)
+        return recipe_ids
+
+    @staticmethod
+    def create_relations(rng, options, users, recipes):
+        relations = (
+            (Follow, 'author_id', users, options['follows_per_user']),
+            (FavoriteUser, 'recipes_id', recipes,
+             options['favorites_per_user']),
+            (ShopCart, 'recipes_id', recipes, options['cart_per_user']),
+        )
+        for model, field, targets, per_user in relations:
+            per_user = min(per_user, len(targets))
+            for start, size in batches(len(users)):
+                model.objects.bulk_create([
+                    model(user_id=user, **{field: target})
+                    for user in users[start:start + size]
+                    for target in rng.sample(targets, per_user)
+                    if target != user or field != 'author_id'
+                ], ignore_conflicts=True)
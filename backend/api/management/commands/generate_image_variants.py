@@ -0,0 +1,44 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.images import generate_variants, mark_ready
+from api.models import Recipes
+
+
+class Command(BaseCommand):
+    help = ('Создаёт уменьшенные копии WebP/JPEG для уже загруженных картинок '
+            'и отмечает их готовыми')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true',
+                            help='Пересоздать уже существующие варианты')
+        parser.add_argument('--workers', type=int,
+                            default=settings.IMAGE_VARIANT_WORKERS)
+
+    def handle(self, *args, **options):
+        names = Recipes.objects.exclude(image='').values_list(
+            'image', flat=True
+        ).distinct().iterator()
+        created = failed = 0
+
+        def process(name):
+            try:
+                return name, generate_variants(
+                    name, force=options['force']
+                ), None
+            except Exception as error:
+                return name, 0, f'{name}: {error}'
+
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            for name, count, error in pool.map(process, names):
+                created += count
+                if error:
+                    failed += 1
+                    self.stderr.write(error)
+                else:
+                    mark_ready(Recipes.objects.filter(image=name), name)
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано вариантов: {created}, ошибок: {failed}'
+        ))
@@ -0,0 +1,164 @@
+import csv
+import io
+import json
+import os
+import re
+from itertools import islice
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from api.cache import bump_version
+from api.models import Ingredient
+
+DEFAULT_PATH = os.path.join(
+    os.path.dirname(settings.BASE_DIR), 'data', 'ingredients.csv'
+)
+READ_SIZE = 64 * 1024
+WHITESPACE = re.compile(r'\s*')
+
+
+def iter_csv(file):
+    reader = csv.reader(file)
+    for row in reader:
+        if not row:
+            continue
+        if len(row) < 2:
+            raise CommandError(
+                f'Строка {reader.line_num}: ожидается название и единица '
+                f'измерения'
+            )
+        yield row[0].strip(), row[1].strip()
+
+
+def iter_json(file):
+    """Читает JSON-массив объектов по частям, не загружая файл целиком
+
+    Разобранная часть буфера отбрасывается только при чтении следующего
+    куска, внутри куска позиция просто сдвигается.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    started = False
+    while True:
+        chunk = file.read(READ_SIZE)
+        buffer = buffer[position:] + chunk
+        position = 0
+        while True:
+            position = WHITESPACE.match(buffer, position).end()
+            if not started:
+                if position == len(buffer):
+                    break
+                if buffer[position] != '[':
+                    raise CommandError('Ожидается JSON-массив')
+                position += 1
+                started = True
+                continue
+            if buffer.startswith(',', position):
+                position = WHITESPACE.match(buffer, position + 1).end()
+            if buffer.startswith(']', position):
+                return
+            try:
+                item, position = decoder.raw_decode(buffer, position)
+            except ValueError:
+                break
+            yield item['name'].strip(), item['measurement_unit'].strip()
+        if not chunk:
+            if buffer[position:].strip():
+                raise CommandError('Неожиданный конец JSON-файла')
+            return
+
+
+def chunked(rows, size):
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class Command(BaseCommand):
+    help = 'Загружает или обновляет каталог ингредиентов из CSV или JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default=DEFAULT_PATH)
+        parser.add_argument('--format', choices=('csv', 'json'),
+                            help='По умолчанию определяется по расширению')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--no-copy', action='store_true',
+                            help='Не использовать COPY на PostgreSQL')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or os.path.splitext(
+            path)[1].lstrip('.').lower()
+        readers = {'csv': iter_csv, 'json': iter_json}
+        if file_format not in readers:
+            raise CommandError(f'Неизвестный формат файла: {path}')
+        use_copy = (connection.vendor == 'postgresql'
+                    and not options['no_copy'])
+        load_chunk = self.copy_chunk if use_copy else self.upsert_chunk
+        created = updated = 0
+        with open(path, encoding='utf-8') as file:
+            rows = readers[file_format](file)
+            for chunk in chunked(rows, options['batch_size']):
+                with transaction.atomic():
+                    chunk_created, chunk_updated = load_chunk(dict(chunk))
+                created += chunk_created
+                updated += chunk_updated
+        bump_version('ingredients')
+        if updated:
+            # Единицы измерения видны в закешированных рецептах
+            bump_version('recipes')
+            bump_version('recipes-deps')
+        self.stdout.write(self.style.SUCCESS(
+            f'Добавлено: {created}, обновлено: {updated}'
+        ))
+
+    @staticmethod
+    def upsert_chunk(units):
+        existing = dict(Ingredient.objects.filter(
+            name__in=units
+        ).values_list('name', 'measurement_unit'))
+        Ingredient.objects.bulk_create(
+            [Ingredient(name=name, measurement_unit=unit)
+             for name, unit in units.items() if name not in existing],
+            ignore_conflicts=True
+        )
+        changed = [name for name, unit in existing.items()
+                   if units[name] != unit]
+        ingredients = list(Ingredient.objects.filter(name__in=changed))
+        for ingredient in ingredients:
+            ingredient.measurement_unit = units[ingredient.name]
+        Ingredient.objects.bulk_update(ingredients, ['measurement_unit'])
+        return len(units) - len(existing), len(ingredients)
+
+    @staticmethod
+    def copy_chunk(units):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(units.items())
+        buffer.seek(0)
+        table = Ingredient._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE TEMP TABLE ingredient_import '
+                '(name text, measurement_unit text) ON COMMIT DROP'
+            )
+            cursor.copy_expert(
+                'COPY ingredient_import (name, measurement_unit) '
+                'FROM STDIN WITH (FORMAT csv)', buffer
+            )
+            cursor.execute(
+                f'INSERT INTO {table} (name, measurement_unit) '
+                f'SELECT name, measurement_unit FROM ingredient_import '
+                f'ON CONFLICT (name) DO UPDATE '
+                f'SET measurement_unit = EXCLUDED.measurement_unit '
+                f'WHERE {table}.measurement_unit '
+                f'IS DISTINCT FROM EXCLUDED.measurement_unit '
+                f'RETURNING (xmax = 0)'
+            )
+            inserted = [row[0] for row in cursor.fetchall()]
+        return inserted.count(True), inserted.count(False)
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from api.shopping_list import find_drift, rebuild
+
+
+class Command(BaseCommand):
+    help = 'Сверяет списки покупок с корзинами и пересобирает расхождения'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help='Только показать расхождения')
+        parser.add_argument('--all', action='store_true',
+                            help='Пересобрать списки всех пользователей')
+
+    def handle(self, *args, **options):
+        if options['all']:
+            rebuild()
+            self.stdout.write(self.style.SUCCESS('Все списки пересобраны'))
+            return
+        drifted = sorted(find_drift())
+        self.stdout.write(f'Пользователей с расхождениями: {len(drifted)}')
+        if drifted and not options['check']:
+            rebuild(drifted)
+            self.stdout.write(self.style.SUCCESS('Расхождения исправлены'))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from api.feed import rebuild_timelines
+
+
+class Command(BaseCommand):
+    help = ('Пересобирает ленты подписок для авторов, у которых '
+            'подписчиков не меньше FEED_FANOUT_THRESHOLD')
+
+    def handle(self, *args, **options):
+        authors = rebuild_timelines()
+        self.stdout.write(self.style.SUCCESS(
+            f'Лент собрано по авторам: {authors}'
+        ))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from api.counters import recompute_counters
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счётчики избранного, корзин, рецептов и подписчиков'
+
+    def handle(self, *args, **options):
+        for counter, drift in recompute_counters().items():
+            self.stdout.write(f'{counter}: исправлено {drift}')
+        self.stdout.write(self.style.SUCCESS('Счётчики пересчитаны'))
@@ -0,0 +1,173 @@
+import logging
+import re
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.db import connections
+
+from .replicas import is_sticky, make_sticky, read_from_replica
+
+logger = logging.getLogger('api.queries')
+
+IN_LIST = re.compile(r'\((?:%s, )+%s\)')
+NUMBER = re.compile(r'\b\d+\b')
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+class QueryBudgetExceeded(Exception):
+    """View выполнил больше SQL-запросов, чем разрешено его бюджетом"""
+
+
+def fingerprint(sql):
+    """Нормализует SQL, чтобы одинаковые по форме запросы совпадали"""
+    return NUMBER.sub('N', IN_LIST.sub('(...)', sql))
+
+
+class QueryStats:
+    """execute_wrapper, который считает запросы и время в БД"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.fingerprints = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+            self.fingerprints[fingerprint(sql)] += 1
+
+    def duplicates(self):
+        return {sql: count for sql, count in self.fingerprints.items()
+                if count > 1}
+
+    def install(self):
+        for connection in connections.all():
+            connection.execute_wrappers.append(self)
+
+    def uninstall(self):
+        for connection in connections.all():
+            if self in connection.execute_wrappers:
+                connection.execute_wrappers.remove(self)
+
+
+class QueryInstrumentationMiddleware:
+    """Считает SQL-запросы запроса, пишет Server-Timing и строку лога
+
+    Бюджет задаётся атрибутом query_budget у view: числом или словарём
+    {метод: бюджет}. При превышении пишется предупреждение, а с
+    QUERY_BUDGET_RAISE = True для GET/HEAD/OPTIONS поднимается
+    QueryBudgetExceeded. Изменяющие запросы к этому моменту уже записаны,
+    поэтому для них превышение только логируется.
+
+    У потоковых ответов запросы выполняются во время отдачи тела, после
+    заголовков, поэтому Server-Timing им не ставится - цифры есть в логе.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = QueryStats()
+        start = time.perf_counter()
+        stats.install()
+        try:
+            response = self.get_response(request)
+        except Exception:
+            stats.uninstall()
+            raise
+        if response.streaming:
+            response.streaming_content = self.stream(
+                response.streaming_content, request, response, stats, start
+            )
+            return response
+        stats.uninstall()
+        self.report(request, response, stats, start,
+                    can_raise=request.method in SAFE_METHODS)
+        response['Server-Timing'] = self.server_timing(stats, start)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view = getattr(view_func, 'cls', view_func)
+        budget = getattr(view, 'query_budget', None)
+        if isinstance(budget, dict):
+            budget = budget.get(request.method)
+        request.query_budget = budget
+        request.query_view = getattr(view, '__name__', repr(view))
+
+    def stream(self, content, request, response, stats, start):
+        try:
+            yield from content
+        finally:
+            stats.uninstall()
+            self.report(request, response, stats, start, can_raise=False)
+
+    @staticmethod
+    def server_timing(stats, start):
+        total = (time.perf_counter() - start) * 1000
+        return (f'db;dur={stats.duration * 1000:.1f};'
+                f'desc="{stats.count} queries", total;dur={total:.1f}')
+
+    @staticmethod
+    def report(request, response, stats, start, can_raise=True):
+        duplicates = stats.duplicates()
+        budget = getattr(request, 'query_budget', None)
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'view': getattr(request, 'query_view', None),
+            'status': response.status_code,
+            'queries': stats.count,
+            'db_ms': round(stats.duration * 1000, 1),
+            'total_ms': round((time.perf_counter() - start) * 1000, 1),
+            'duplicates': sum(duplicates.values()),
+            'budget': budget,
+            'auth_cache': getattr(request, 'auth_cache', None),
+        }
+        logger.info(' '.join(f'{key}={value}'
+                             for key, value in record.items()),
+                    extra={'query_stats': record})
+        if budget is None or stats.count <= budget:
+            return
+        message = (f'{record["view"]}: {stats.count} SQL-запросов при '
+                   f'бюджете {budget}')
+        if duplicates:
+            sql, count = max(duplicates.items(), key=lambda item: item[1])
+            message += f', повторяется {count} раз: {sql}'
+        if can_raise and getattr(settings, 'QUERY_BUDGET_RAISE', False):
+            raise QueryBudgetExceeded(message)
+        logger.warning(message, extra={'query_stats': record})
+
+
+class ReplicaRoutingMiddleware:
+    """GET и HEAD читают с реплики, пока клиент недавно ничего не писал
+
+    После успешного изменяющего запроса клиент на REPLICA_STICKY_SECONDS
+    закрепляется за основной базой, чтобы видеть свои изменения.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        replica = (request.method in SAFE_METHODS
+                   and not is_sticky(request))
+        with read_from_replica(replica):
+            response = self.get_response(request)
+        if replica and response.streaming:
+            response.streaming_content = self.stream(
+                response.streaming_content
+            )
+        if request.method not in SAFE_METHODS \
+                and response.status_code < 400:
+            make_sticky(request, response)
+        return response
+
+    @staticmethod
+    def stream(content):
+        with read_from_replica():
+            yield from content
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.16 on 2026-10-18 17:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_auto_20220905_2318'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='ingredient',
+            name='name',
+            field=models.CharField(max_length=200, unique=True, verbose_name='Имя ингредиента'),
+        ),
+    ]
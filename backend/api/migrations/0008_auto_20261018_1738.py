@@ -0,0 +1,17 @@
+# Generated by Django 2.2.16 on 2026-10-18 17:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_auto_20261018_1736'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='recipes',
+            index=models.Index(fields=['-pub_date', '-id'], name='recipes_pub_date_id_idx'),
+        ),
+    ]
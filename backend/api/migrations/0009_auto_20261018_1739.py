@@ -0,0 +1,25 @@
+# Generated by Django 2.2.16 on 2026-10-18 17:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_auto_20261018_1738'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='ingredientforrecipe',
+            name='unique recipe',
+        ),
+        migrations.AddIndex(
+            model_name='recipes',
+            index=models.Index(fields=['author', '-pub_date', '-id'], name='recipes_author_pub_date_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='ingredientforrecipe',
+            constraint=models.UniqueConstraint(fields=('recipe', 'ingredients'), name='unique recipe'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 2.2.16 on 2026-10-18 17:44
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_counters(apps, schema_editor):
+    Recipes = apps.get_model('api', 'Recipes')
+    for field, model_name in (('favorites_count', 'FavoriteUser'),
+                              ('in_carts_count', 'ShopCart')):
+        related = apps.get_model('api', model_name)
+        counts = related.objects.filter(recipes=OuterRef('pk')).order_by(
+        ).values('recipes').annotate(total=Count('pk')).values('total')
+        Recipes.objects.update(**{field: Coalesce(
+            Subquery(counts, output_field=IntegerField()), 0
+        )})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_auto_20261018_1739'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipes',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В избранном'),
+        ),
+        migrations.AddField(
+            model_name='recipes',
+            name='in_carts_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В корзинах'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
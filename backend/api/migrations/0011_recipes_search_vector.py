@@ -0,0 +1,65 @@
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+SEARCH_VECTOR = """
+    setweight(to_tsvector('pg_catalog.russian', coalesce({row}name, '')), 'A')
+    || setweight(to_tsvector('pg_catalog.russian', coalesce({row}text, '')),
+                 'B')
+"""
+
+CREATE_SQL = f"""
+CREATE INDEX recipes_search_vector_gin ON api_recipes
+    USING gin (search_vector);
+
+CREATE FUNCTION api_recipes_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector := {SEARCH_VECTOR.format(row='NEW.')};
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER api_recipes_search_vector_trigger
+    BEFORE INSERT OR UPDATE OF name, text ON api_recipes
+    FOR EACH ROW EXECUTE PROCEDURE api_recipes_search_vector_update();
+
+UPDATE api_recipes SET search_vector = {SEARCH_VECTOR.format(row='')};
+"""
+
+DROP_SQL = """
+DROP TRIGGER IF EXISTS api_recipes_search_vector_trigger ON api_recipes;
+DROP FUNCTION IF EXISTS api_recipes_search_vector_update();
+DROP INDEX IF EXISTS recipes_search_vector_gin;
+"""
+
+
+def run_on_postgresql(sql):
+    def operation(apps, schema_editor):
+        if schema_editor.connection.vendor == 'postgresql':
+            schema_editor.execute(sql)
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_auto_20261018_1744'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipes',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddIndex(
+                    model_name='recipes',
+                    index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='recipes_search_vector_gin'),
+                ),
+            ],
+        ),
+        migrations.RunPython(run_on_postgresql(CREATE_SQL),
+                             run_on_postgresql(DROP_SQL)),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 2.2.16 on 2026-10-18 17:46
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_shopping_lists(apps, schema_editor):
+    ShopCart = apps.get_model('api', 'ShopCart')
+    ShoppingListItem = apps.get_model('api', 'ShoppingListItem')
+    rows = ShopCart.objects.values_list(
+        'user_id', 'recipes__recipes__ingredients_id'
+    ).annotate(total=models.Sum('recipes__recipes__amount')).order_by()
+    ShoppingListItem.objects.bulk_create([
+        ShoppingListItem(user_id=user_id, ingredient_id=ingredient_id,
+                         amount=total)
+        for user_id, ingredient_id, total in rows.iterator()
+        if ingredient_id is not None
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('api', '0011_recipes_search_vector'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShoppingListItem',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.IntegerField(verbose_name='Количество')),
+                ('ingredient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shopping_list_items', to='api.Ingredient', verbose_name='Ингредиент')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shopping_list', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Позиция списка покупок',
+                'verbose_name_plural': 'Списки покупок',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='shoppinglistitem',
+            constraint=models.UniqueConstraint(fields=('user', 'ingredient'), name='unique shopping list item'),
+        ),
+        migrations.RunPython(fill_shopping_lists, migrations.RunPython.noop),
+    ]
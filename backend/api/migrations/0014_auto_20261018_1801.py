@@ -0,0 +1,27 @@
+# Generated by Django 2.2.16 on 2026-10-18 18:01
+
+from django.db import migrations, models
+from django.db.models import F
+import django.utils.timezone
+
+
+def fill_updated_at(apps, schema_editor):
+    Recipes = apps.get_model('api', 'Recipes')
+    Recipes.objects.update(updated_at=F('pub_date'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_auto_20261018_1754'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipes',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now, verbose_name='Дата изменения'),
+            preserve_default=False,
+        ),
+        migrations.RunPython(fill_updated_at, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.16 on 2026-10-18 18:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_auto_20261018_1801'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipes',
+            name='variants_image',
+            field=models.CharField(blank=True, editable=False, max_length=100, verbose_name='Картинка с готовыми вариантами'),
+        ),
+    ]
@@ -1,12 +1,14 @@
 from colorfield.fields import ColorField
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models
-from users.models import User
+from users.models import DenormalizedFieldsMixin, User
 
 
 class Ingredient(models.Model):
     """Модель ингредиентов"""
-    name = models.CharField('Имя ингредиента', max_length=20, unique=True)
+    name = models.CharField('Имя ингредиента', max_length=200, unique=True)
     measurement_unit = models.CharField('Ед.измерения', max_length=10)
 
     class Meta:
@@ -33,7 +35,7 @@ class Tags(models.Model):
         return self.name
 
 
-class Recipes(models.Model):
+class Recipes(DenormalizedFieldsMixin, models.Model):
     """Модель рецептов"""
     author = models.ForeignKey(
         User,
@@ -62,11 +64,35 @@ class Recipes(models.Model):
     pub_date = models.DateTimeField(
         auto_now_add=True
     )
+    updated_at = models.DateTimeField(
+        'Дата изменения', auto_now=True
+    )
+    favorites_count = models.PositiveIntegerField(
+        'В избранном', default=0, editable=False
+    )
+    in_carts_count = models.PositiveIntegerField(
+        'В корзинах', default=0, editable=False
+    )
+    search_vector = SearchVectorField(null=True, editable=False)
+    variants_image = models.CharField(
+        'Картинка с готовыми вариантами', max_length=100, blank=True,
+        editable=False
+    )
+    denormalized_fields = ('favorites_count', 'in_carts_count',
+                           'variants_image')
 
     class Meta:
         ordering = ("-pub_date",)
         verbose_name = 'Рецепт'
         verbose_name_plural = "Рецепты"
+        indexes = (
+            models.Index(fields=('-pub_date', '-id'),
+                         name='recipes_pub_date_id_idx'),
+            models.Index(fields=('author', '-pub_date', '-id'),
+                         name='recipes_author_pub_date_idx'),
+            GinIndex(fields=('search_vector',),
+                     name='recipes_search_vector_gin'),
+        )
 
     def __str__(self):
         return self.name
@@ -93,7 +119,7 @@ class IngredientForRecipe(models.Model):
         verbose_name_plural = "Ингредиенты для рецептов"
         constraints = (
             models.UniqueConstraint(
-                fields=('ingredients', 'recipe',),
+                fields=('recipe', 'ingredients',),
                 name='unique recipe',
             ),
         )
@@ -137,3 +163,49 @@ class ShopCart(models.Model):
             models.UniqueConstraint(fields=['user', 'recipes'],
                                     name='unique ShopCart')
         ]
+
+
+class ShoppingListItem(models.Model):
+    """Сумма ингредиента в списке покупок пользователя"""
+    user = models.ForeignKey(User,
+                             on_delete=models.CASCADE,
+                             related_name="shopping_list",
+                             verbose_name="Пользователь")
+    ingredient = models.ForeignKey(Ingredient,
+                                   on_delete=models.CASCADE,
+                                   related_name="shopping_list_items",
+                                   verbose_name="Ингредиент")
+    amount = models.IntegerField(verbose_name="Количество")
+
+    class Meta:
+        verbose_name = "Позиция списка покупок"
+        verbose_name_plural = "Списки покупок"
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'ingredient'],
+                                    name='unique shopping list item')
+        ]
+
+
+class TimelineEntry(models.Model):
+    """Рецепт в заранее собранной ленте подписчика"""
+    user = models.ForeignKey(User,
+                             on_delete=models.CASCADE,
+                             related_name="timeline",
+                             verbose_name="Подписчик")
+    recipe = models.ForeignKey(Recipes,
+                               on_delete=models.CASCADE,
+                               related_name="timeline_entries",
+                               verbose_name="Рецепт")
+    pub_date = models.DateTimeField("Дата публикации")
+
+    class Meta:
+        verbose_name = "Запись ленты"
+        verbose_name_plural = "Ленты подписок"
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'recipe'],
+                                    name='unique timeline entry')
+        ]
+        indexes = (
+            models.Index(fields=('user', '-pub_date', '-recipe'),
+                         name='timeline_user_pub_date_idx'),
+        )
@@ -0,0 +1,136 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+from datetime import datetime
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """Курсорная пагинация по набору полей без COUNT(*) и OFFSET
+
+    Курсор хранит значения полей сортировки последней записи страницы,
+    следующая страница выбирается условием «строго после курсора», поэтому
+    глубокие страницы стоят столько же, сколько первая.
+    """
+    cursor_query_param = 'cursor'
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'limit'
+    max_page_size = 100
+    ordering = ('-pub_date', '-id')
+    invalid_cursor_message = 'Неверный курсор'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.ordering = getattr(view, 'cursor_ordering', self.ordering)
+        self.page_size = self.get_page_size(request)
+        queryset = queryset.order_by(*self.ordering)
+        position = self.decode_cursor(request, queryset.model)
+        if position is not None:
+            queryset = queryset.filter(self.after(position))
+        page = list(queryset[:self.page_size + 1])
+        self.has_next = len(page) > self.page_size
+        self.page = page[:self.page_size]
+        return self.page
+
+    def get_page_size(self, request):
+        value = request.query_params.get(self.page_size_query_param, '')
+        if value.isdigit() and int(value) > 0:
+            return min(int(value), self.max_page_size)
+        return self.page_size
+
+    def after(self, position):
+        """Лексикографическое условие (f1, f2, ...) после position"""
+        condition = Q()
+        equal = {}
+        for field, value in zip(self.ordering, position):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= Q(**equal, **{f'{name}__{lookup}': value})
+            equal[name] = value
+        return condition
+
+    def decode_cursor(self, request, model):
+        """Значения полей сортировки из курсора, приведённые к типам полей
+        модели; любой испорченный курсор - 404, а не 500"""
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            values = json.loads(urlsafe_b64decode(encoded.encode()))
+            if not isinstance(values, list) or (
+                    len(values) != len(self.ordering)):
+                raise ValueError
+            position = [
+                model._meta.get_field(field.lstrip('-')).to_python(value)
+                for field, value in zip(self.ordering, values)
+            ]
+            if None in position:
+                raise ValueError
+        except (FieldDoesNotExist, TypeError, ValidationError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        return position
+
+    def encode_cursor(self, instance):
+        position = []
+        for field in self.ordering:
+            value = getattr(instance, field.lstrip('-'))
+            if isinstance(value, datetime):
+                value = value.isoformat()
+            position.append(value)
+        return urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.cursor_query_param,
+            self.encode_cursor(self.page[-1])
+        )
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
+
+
+class FeedPagination(KeysetPagination):
+    """Курсорная пагинация ленты, ключи страницы отдаёт view.feed_keys"""
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        keys = view.feed_keys(self.decode_cursor(request, queryset.model),
+                              self.page_size + 1)
+        self.has_next = len(keys) > self.page_size
+        ids = [pk for _, pk in keys[:self.page_size]]
+        objects = queryset.in_bulk(ids)
+        self.page = [objects[pk] for pk in ids if pk in objects]
+        return self.page
+
+
+class PageOrKeysetPagination(PageNumberPagination):
+    """Пагинация по номеру страницы, курсорная при ?pagination=cursor"""
+    page_size_query_param = 'limit'
+    max_page_size = 100
+    mode_query_param = 'pagination'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        if request.query_params.get(self.mode_query_param) == 'cursor':
+            self.keyset = KeysetPagination()
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
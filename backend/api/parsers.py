@@ -0,0 +1,24 @@
+import codecs
+
+import orjson
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+
+from .renderers import ORJSONRenderer
+
+
+class ORJSONParser(JSONParser):
+    """JSONParser на orjson, NaN и Infinity не принимает"""
+    renderer_class = ORJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        content = stream.read() if stream is not None else b''
+        if codecs.lookup(encoding).name != 'utf-8':
+            content = content.decode(encoding)
+        try:
+            return orjson.loads(content)
+        except (orjson.JSONDecodeError, UnicodeDecodeError) as exc:
+            raise ParseError('JSON parse error - %s' % str(exc))
@@ -0,0 +1,74 @@
+import hashlib
+import random
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+
+STICKY_COOKIE = 'db_primary'
+
+state = threading.local()
+
+
+@contextmanager
+def read_from_replica(enabled=True):
+    """Внутри блока чтения уходят на реплику (если она настроена)"""
+    previous = getattr(state, 'replica', False)
+    state.replica = enabled
+    try:
+        yield
+    finally:
+        state.replica = previous
+
+
+def client_key(request):
+    """Ключ клиента по токену или сессии, None для анонима"""
+    credential = (request.META.get('HTTP_AUTHORIZATION')
+                  or request.COOKIES.get(settings.SESSION_COOKIE_NAME))
+    if not credential:
+        return None
+    digest = hashlib.md5(credential.encode()).hexdigest()
+    return f'db-sticky:{digest}'
+
+
+def is_sticky(request):
+    """Клиент недавно писал и должен читать с основной базы"""
+    if STICKY_COOKIE in request.COOKIES:
+        return True
+    key = client_key(request)
+    return key is not None and cache.get(key) is not None
+
+
+def make_sticky(request, response):
+    seconds = settings.REPLICA_STICKY_SECONDS
+    key = client_key(request)
+    if key is not None:
+        cache.set(key, 1, seconds)
+    response.set_cookie(STICKY_COOKIE, '1', max_age=seconds,
+                        httponly=True, samesite='Lax')
+
+
+class ReplicaRouter:
+    """Отправляет чтения на реплики, если это разрешено для запроса
+
+    Запись, миграции и чтения внутри транзакции остаются на основной базе.
+    """
+
+    def db_for_read(self, model, **hints):
+        replicas = settings.DATABASE_REPLICAS
+        if not replicas or not getattr(state, 'replica', False):
+            return DEFAULT_DB_ALIAS
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
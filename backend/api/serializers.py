@@ -1,7 +1,10 @@
+from collections import Counter
+
 from djoser.serializers import UserCreateSerializer, UserSerializer
 from drf_extra_fields.fields import Base64ImageField
 from rest_framework.validators import UniqueTogetherValidator
 from users.models import User, Follow
+from .images import variant_urls
 from .models import Recipes, Tags, Ingredient, FavoriteUser, ShopCart, \
     IngredientForRecipe
 from rest_framework import serializers
@@ -9,10 +12,21 @@ from rest_framework import serializers
 
 class ShortRecipeSerializer(serializers.ModelSerializer):
     """Краткая информация о рецепте"""
+    image_variants = serializers.SerializerMethodField(read_only=True)
 
     class Meta:
         model = Recipes
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'image_variants', 'cooking_time')
+
+    def get_image_variants(self, obj):
+        return variant_urls(obj, self.context.get('request'))
+
+
+def get_recipes_limit(request):
+    """Значение recipes_limit из запроса, None если оно не задано или
+    не является неотрицательным числом"""
+    recipes_limit = request.query_params.get('recipes_limit', '')
+    return int(recipes_limit) if recipes_limit.isdigit() else None
 
 
 class CustomUserSerializer(UserSerializer):
@@ -33,6 +47,8 @@ class CustomUserSerializer(UserSerializer):
         user = self.context.get('request').user
         if user.is_anonymous:
             return False
+        if hasattr(obj, 'is_following'):
+            return obj.is_following
         return Follow.objects.filter(user=user, author=obj.id).exists()
 
 
@@ -40,7 +56,7 @@ class FollowUserSerializer(CustomUserSerializer):
     """Подписка на пользователя"""
 
     recipes = serializers.SerializerMethodField(read_only=True)
-    recipes_count = serializers.SerializerMethodField(read_only=True)
+    recipes_count = serializers.ReadOnlyField()
 
     class Meta:
         model = User
@@ -48,21 +64,19 @@ class FollowUserSerializer(CustomUserSerializer):
             'email', 'id', 'username', 'first_name', 'last_name', 'recipes',
             'recipes_count')
 
-    @staticmethod
-    def get_recipes_count(obj):
-        return obj.recipes.count()
-
     def get_recipes(self, obj):
         request = self.context.get('request')
         recipes = obj.recipes.all()
-        recipes_limit = request.query_params.get('recipes_limit')
-        if recipes_limit:
-            recipes = recipes[:int(recipes_limit)]
-        return ShortRecipeSerializer(recipes, many=True).data
+        recipes_limit = get_recipes_limit(request)
+        if recipes_limit is not None:
+            recipes = recipes[:recipes_limit]
+        return ShortRecipeSerializer(recipes, many=True,
+                                     context=self.context).data
 
 
 class FavoriteSerializer(serializers.ModelSerializer):
     """Избранное пользователя"""
+    user = serializers.HiddenField(default=serializers.CurrentUserDefault())
 
     class Meta:
         fields = ('user', 'recipes')
@@ -85,6 +99,7 @@ class FavoriteSerializer(serializers.ModelSerializer):
 
 class ShoppingSerializer(serializers.ModelSerializer):
     """Покупки пользователя"""
+    user = serializers.HiddenField(default=serializers.CurrentUserDefault())
 
     class Meta:
         fields = ('user', 'recipes')
@@ -105,6 +120,18 @@ class ShoppingSerializer(serializers.ModelSerializer):
         ).data
 
 
+class BulkRecipesSerializer(serializers.Serializer):
+    """Список id рецептов для массового добавления и удаления"""
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=100,
+    )
+
+    def validate_recipes(self, value):
+        return list(dict.fromkeys(value))
+
+
 class IngredientSerializer(serializers.ModelSerializer):
     """Ингридиенты"""
 
@@ -157,13 +184,39 @@ class IngredientAmountSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', "measurement_unit", "amount")
 
 
-class RecipesSerializer(serializers.ModelSerializer):
+def sparse_fields(request, fields):
+    """Поля из fields, оставшиеся после ?fields= и ?omit= (id остаётся)"""
+    keep = set(fields)
+    if request is None:
+        return keep
+    only = request.query_params.get('fields')
+    if only:
+        keep &= {name.strip() for name in only.split(',')} | {'id'}
+    omit = request.query_params.get('omit')
+    if omit:
+        keep -= {name.strip() for name in omit.split(',')} - {'id'}
+    return keep
+
+
+class SparseFieldsMixin:
+    """Убирает из сериализатора поля, не запрошенные через ?fields=/?omit="""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        keep = sparse_fields(self.context.get('request'), self.fields)
+        for name in list(self.fields):
+            if name not in keep:
+                self.fields.pop(name)
+
+
+class RecipesSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """Рецепты"""
     ingredients = serializers.SerializerMethodField(read_only=True)
     tags = TagsSerializer(many=True)
     author = CustomUserSerializer(read_only=True)
     is_favorited = serializers.SerializerMethodField(read_only=True)
     is_in_shopping_cart = serializers.SerializerMethodField(read_only=True)
+    image_variants = serializers.SerializerMethodField(read_only=True)
 
     class Meta:
         model = Recipes
@@ -174,20 +227,25 @@ class RecipesSerializer(serializers.ModelSerializer):
             'ingredients',
             'name',
             'image',
+            'image_variants',
             'text',
             'cooking_time',
             'is_favorited',
             'is_in_shopping_cart'
         )
 
+    def get_image_variants(self, obj):
+        return variant_urls(obj, self.context.get('request'))
+
     def get_ingredients(self, obj):
-        queryset = IngredientForRecipe.objects.filter(recipe=obj)
-        return IngredientAmountSerializer(queryset, many=True).data
+        return IngredientAmountSerializer(obj.recipes.all(), many=True).data
 
     def get_is_favorited(self, obj):
         request = self.context.get('request')
         if not request or request.user.is_anonymous:
             return False
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         return FavoriteUser.objects.filter(user=request.user,
                                            recipes=obj).exists()
 
@@ -195,13 +253,15 @@ class RecipesSerializer(serializers.ModelSerializer):
         request = self.context.get('request')
         if not request or request.user.is_anonymous:
             return False
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         return ShopCart.objects.filter(
             user=request.user, recipes=obj).exists()
 
 
 class IngredientAmountRecipeSerializer(serializers.ModelSerializer):
     """Количество ингредиента"""
-    id = serializers.PrimaryKeyRelatedField(queryset=Ingredient.objects.all())
+    id = serializers.IntegerField()
     amount = serializers.IntegerField()
 
     class Meta:
@@ -209,10 +269,18 @@ class IngredientAmountRecipeSerializer(serializers.ModelSerializer):
         fields = ('id', 'amount')
 
 
+def get_duplicates(values):
+    return sorted(value for value, count in Counter(values).items()
+                  if count > 1)
+
+
+def join_ids(ids):
+    return ', '.join(str(pk) for pk in ids)
+
+
 class RecipeSerializerPost(serializers.ModelSerializer):
     """Создание рецепта"""
-    tags = serializers.PrimaryKeyRelatedField(
-        queryset=Tags.objects.all(), many=True)
+    tags = serializers.ListField(child=serializers.IntegerField())
     ingredients = IngredientAmountRecipeSerializer(many=True)
     author = CustomUserSerializer(read_only=True)
     image = Base64ImageField(required=False, allow_null=True)
@@ -224,39 +292,53 @@ class RecipeSerializerPost(serializers.ModelSerializer):
             'name', 'text', 'cooking_time')
 
     def validate(self, data):
-        ingredients = data['ingredients']
-        ingredients_list = []
-        for ingredient in ingredients:
-            ingredient_id = ingredient['id']
-            if ingredient_id in ingredients_list:
-                raise serializers.ValidationError({
-                    'ingredients': 'Ингредиентам нельзя повторяться!'
-                })
-            ingredients_list.append(ingredient_id)
-            amount = ingredient['amount']
-            if int(amount) <= 0:
-                raise serializers.ValidationError({
-                    'amount': 'В рецепте должен быть ингредиент!'
-                })
-
-        tags = data['tags']
-        if not tags:
-            raise serializers.ValidationError({
-                'tags': 'Выберите минимум один тег!'
-            })
-        tags_list = []
-        for tag in tags:
-            if tag in tags_list:
-                raise serializers.ValidationError({
-                    'tags': 'Теги - уникальны!'
-                })
-            tags_list.append(tag)
-
-        cooking_time = data['cooking_time']
-        if int(cooking_time) <= 0:
-            raise serializers.ValidationError({
-                'cooking_time': 'Время не может быть меньше 1 минуты!'
-            })
+        errors = {}
+        if 'ingredients' in data:
+            ingredients = data['ingredients']
+            ids = [ingredient['id'] for ingredient in ingredients]
+            found = Ingredient.objects.in_bulk(set(ids))
+            messages = []
+            missing = sorted(set(ids) - found.keys())
+            if missing:
+                messages.append(
+                    f'Ингредиенты не найдены: {join_ids(missing)}'
+                )
+            duplicates = get_duplicates(ids)
+            if duplicates:
+                messages.append(
+                    f'Ингредиентам нельзя повторяться: {join_ids(duplicates)}'
+                )
+            if messages:
+                errors['ingredients'] = messages
+            if any(int(ingredient['amount']) <= 0
+                   for ingredient in ingredients):
+                errors['amount'] = 'В рецепте должен быть ингредиент!'
+            for ingredient in ingredients:
+                ingredient['id'] = found.get(ingredient['id'])
+
+        if 'tags' in data:
+            tags = data['tags']
+            found = Tags.objects.in_bulk(set(tags))
+            messages = []
+            if not tags:
+                messages.append('Выберите минимум один тег!')
+            missing = sorted(set(tags) - found.keys())
+            if missing:
+                messages.append(f'Теги не найдены: {join_ids(missing)}')
+            duplicates = get_duplicates(tags)
+            if duplicates:
+                messages.append(
+                    f'Теги - уникальны! Повторяются: {join_ids(duplicates)}'
+                )
+            if messages:
+                errors['tags'] = messages
+            data['tags'] = [found[tag] for tag in tags if tag in found]
+
+        cooking_time = data.get('cooking_time')
+        if cooking_time is not None and int(cooking_time) <= 0:
+            errors['cooking_time'] = 'Время не может быть меньше 1 минуты!'
+        if errors:
+            raise serializers.ValidationError(errors)
         return data
 
     def to_representation(self, instance):
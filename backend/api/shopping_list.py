@@ -0,0 +1,175 @@
+import csv
+import json
+
+from django.db import transaction
+from django.db.models import F, Sum
+
+from users.models import User
+from .models import IngredientForRecipe, ShopCart, ShoppingListItem
+
+BATCH_SIZE = 5000
+
+SHOPPING_LIST_FORMATS = {
+    'txt': ('text/plain; charset=utf-8', 'BuyList.txt'),
+    'csv': ('text/csv; charset=utf-8', 'BuyList.csv'),
+    'json': ('application/json', 'BuyList.json'),
+}
+
+
+def get_shopping_list(user):
+    """Готовые суммы ингредиентов пользователя одним индексным чтением"""
+    return ShoppingListItem.objects.filter(user=user).values(
+        'amount',
+        name=F('ingredient__name'),
+        measurement_unit=F('ingredient__measurement_unit'),
+    ).order_by('ingredient__name')
+
+
+def recipe_amounts(recipe_ids):
+    """Суммы ингредиентов по нескольким рецептам"""
+    return dict(IngredientForRecipe.objects.filter(
+        recipe_id__in=recipe_ids
+    ).values_list('ingredients_id').annotate(total=Sum('amount')).order_by())
+
+
+@transaction.atomic(savepoint=False)
+def apply_deltas(user_ids, deltas, locked=False):
+    """Прибавляет deltas {ингредиент: количество} к спискам пользователей
+
+    locked - вызывающий уже заблокировал строки пользователей в этой
+    транзакции.
+    """
+    deltas = {pk: delta for pk, delta in deltas.items() if delta}
+    user_ids = sorted(set(user_ids))
+    if not deltas or not user_ids:
+        return
+    if not locked:
+        list(User.objects.select_for_update().filter(
+            pk__in=user_ids
+        ).order_by('pk').values_list('pk'))
+    items = list(ShoppingListItem.objects.filter(
+        user_id__in=user_ids, ingredient_id__in=deltas
+    ))
+    for item in items:
+        item.amount = F('amount') + deltas[item.ingredient_id]
+    if items:
+        ShoppingListItem.objects.bulk_update(items, ['amount'])
+    present = {(item.user_id, item.ingredient_id) for item in items}
+    ShoppingListItem.objects.bulk_create([
+        ShoppingListItem(user_id=user_id, ingredient_id=pk, amount=delta)
+        for user_id in user_ids
+        for pk, delta in deltas.items()
+        if delta > 0 and (user_id, pk) not in present
+    ])
+    if any(delta < 0 for delta in deltas.values()):
+        ShoppingListItem.objects.filter(
+            user_id__in=user_ids, ingredient_id__in=deltas, amount__lte=0
+        ).delete()
+
+
+def add_recipes(user_id, recipe_ids, sign=1, locked=False):
+    """Учитывает рецепты, добавленные в корзину (или убранные при sign=-1)"""
+    apply_deltas([user_id], {pk: sign * amount for pk, amount
+                             in recipe_amounts(recipe_ids).items()}, locked)
+
+
+def add_recipe(user_id, recipe_id, sign=1):
+    add_recipes(user_id, [recipe_id], sign)
+
+
+def apply_recipe_change(recipe_id, deltas):
+    """Переносит изменение ингредиентов рецепта в списки его покупателей"""
+    user_ids = ShopCart.objects.filter(
+        recipes_id=recipe_id
+    ).values_list('user_id', flat=True)
+    apply_deltas(list(user_ids), deltas)
+
+
+def expected_totals(user_ids=None):
+    """Суммы (пользователь, ингредиент, количество) по корзинам"""
+    queryset = ShopCart.objects.all()
+    if user_ids is not None:
+        queryset = queryset.filter(user_id__in=user_ids)
+    rows = queryset.values_list(
+        'user_id', 'recipes__recipes__ingredients_id'
+    ).annotate(total=Sum('recipes__recipes__amount')).order_by()
+    return (row for row in rows.iterator() if row[1] is not None)
+
+
+def find_drift():
+    """Позиции (пользователь, ингредиент), расходящиеся с корзинами"""
+    stored = {(user_id, pk): amount for user_id, pk, amount
+              in ShoppingListItem.objects.values_list(
+                  'user_id', 'ingredient_id', 'amount').iterator()}
+    drifted = set()
+    for user_id, pk, total in expected_totals():
+        if stored.pop((user_id, pk), None) != total:
+            drifted.add(user_id)
+    drifted.update(user_id for user_id, _ in stored)
+    return drifted
+
+
+@transaction.atomic
+def rebuild(user_ids=None):
+    """Пересобирает списки покупок (всех или указанных пользователей)"""
+    items = ShoppingListItem.objects.all()
+    if user_ids is not None:
+        items = items.filter(user_id__in=user_ids)
+    items.delete()
+    batch = []
+    for user_id, pk, total in expected_totals(user_ids):
+        batch.append(ShoppingListItem(user_id=user_id, ingredient_id=pk,
+                                      amount=total))
+        if len(batch) >= BATCH_SIZE:
+            ShoppingListItem.objects.bulk_create(batch)
+            batch = []
+    ShoppingListItem.objects.bulk_create(batch)
+
+
+class Echo:
+    """Буфер для csv.writer, который сразу отдаёт записанную строку"""
+
+    def write(self, value):
+        return value
+
+
+def render_txt(rows):
+    yield 'Список ваших покупок:\n'
+    for row in rows:
+        yield (f'{row["name"]} - {row["amount"]} '
+               f'{row["measurement_unit"]};\n')
+    yield '\n- Ваш сервис рецептов Foodgram\n'
+
+
+def render_csv(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(('name', 'amount', 'measurement_unit'))
+    for row in rows:
+        yield writer.writerow(
+            (row['name'], row['amount'], row['measurement_unit'])
+        )
+
+
+def render_json(rows):
+    yield '['
+    separator = ''
+    for row in rows:
+        yield separator + json.dumps({
+            'name': row['name'],
+            'amount': row['amount'],
+            'measurement_unit': row['measurement_unit'],
+        }, ensure_ascii=False)
+        separator = ','
+    yield ']'
+
+
+RENDERERS = {
+    'txt': render_txt,
+    'csv': render_csv,
+    'json': render_json,
+}
+
+
+def stream_shopping_list(rows, file_format):
+    """Построчно отдаёт список покупок в выбранном формате"""
+    return RENDERERS[file_format](rows)
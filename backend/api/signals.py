@@ -0,0 +1,184 @@
+from django.db import transaction
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete, pre_save)
+from django.dispatch import receiver
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from users.models import Follow, User
+
+from .authentication import invalidate_token
+from .cache import bump_version
+from .counters import COUNTERS, change_counter
+from .feed import (fan_out_recipe, fanout_threshold, follow_added,
+                   follow_removed, schedule)
+from .images import refresh_variants, remove_variants, schedule_variants
+from .models import Ingredient, IngredientForRecipe, Recipes, ShopCart, Tags
+from .shopping_list import add_recipe
+
+
+def invalidate_recipes(*namespaces):
+    """Сбрасывает кеш рецептов для анонимов после коммита транзакции"""
+    def bump():
+        for namespace in ('recipes', *namespaces):
+            bump_version(namespace)
+    transaction.on_commit(bump)
+
+
+@receiver([post_save, post_delete], sender=Tags)
+def invalidate_tags(**kwargs):
+    bump_version('tags')
+    invalidate_recipes('recipes-deps')
+
+
+@receiver([post_save, post_delete], sender=Ingredient)
+def invalidate_ingredients(**kwargs):
+    bump_version('ingredients')
+    invalidate_recipes('recipes-deps')
+
+
+@receiver([post_save, post_delete], sender=Recipes)
+def invalidate_recipe(instance, **kwargs):
+    invalidate_recipes(f'recipes:{instance.pk}')
+
+
+def touch_recipes(pks):
+    """Сдвигает updated_at рецептов в текущей транзакции и сбрасывает их кеш
+
+    Для правок мимо сохранения самого рецепта: строки ингредиентов в
+    админке, теги со стороны тега.
+    """
+    pks = list(pks)
+    if not pks:
+        return
+    Recipes.objects.filter(pk__in=pks).update(updated_at=timezone.now())
+    invalidate_recipes(*(f'recipes:{pk}' for pk in pks))
+
+
+# Со стороны рецепта API и админка меняют теги и ингредиенты вместе с
+# сохранением рецепта, которое и сдвигает updated_at, поэтому здесь только
+# сбрасывается кеш: иначе удаление рецепта давало бы UPDATE на каждую строку.
+@receiver(m2m_changed, sender=Recipes.tags.through)
+@receiver(m2m_changed, sender=Recipes.ingredients.through)
+def invalidate_recipe_relations(instance, action, reverse, pk_set, **kwargs):
+    """Теги и ингредиенты рецепта; со стороны тега (tag.recipes.add)
+    рецепты берутся из pk_set"""
+    if not reverse:
+        if action.startswith('post_'):
+            invalidate_recipes(f'recipes:{instance.pk}')
+    elif action in ('post_add', 'post_remove'):
+        touch_recipes(pk_set)
+    elif action == 'pre_clear':
+        touch_recipes(instance.recipes.values_list('pk', flat=True))
+
+
+@receiver([post_save, post_delete], sender=IngredientForRecipe)
+def invalidate_recipe_ingredients(instance, **kwargs):
+    invalidate_recipes(f'recipes:{instance.recipe_id}')
+
+
+CREDENTIAL_FIELDS = {'password', 'is_active'}
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_deleted_token(instance, **kwargs):
+    """Выход и удаление пользователя (каскадом) сбрасывают кеш токена"""
+    key = instance.key
+    transaction.on_commit(lambda: invalidate_token(key))
+
+
+@receiver(pre_save, sender=User)
+def check_credentials(instance, update_fields=None, **kwargs):
+    instance._credentials_changed = False
+    if instance._state.adding or (
+            update_fields is not None
+            and not CREDENTIAL_FIELDS & set(update_fields)):
+        return
+    previous = User.objects.filter(pk=instance.pk).values(
+        *CREDENTIAL_FIELDS
+    ).first()
+    instance._credentials_changed = previous is not None and any(
+        previous[field] != getattr(instance, field)
+        for field in CREDENTIAL_FIELDS
+    )
+
+
+@receiver(post_save, sender=User)
+def invalidate_user_tokens(instance, **kwargs):
+    """Смена пароля или деактивация сбрасывают кеш токена пользователя"""
+    if not getattr(instance, '_credentials_changed', False):
+        return
+    for key in Token.objects.filter(user=instance).values_list(
+            'key', flat=True):
+        transaction.on_commit(lambda key=key: invalidate_token(key))
+
+
+@receiver([post_save, post_delete], sender=User)
+def invalidate_authors(created=False, update_fields=None, **kwargs):
+    if created or (update_fields is not None
+                   and set(update_fields) <= {'last_login'}):
+        return
+    invalidate_recipes('recipes-deps')
+
+
+@receiver(post_save, sender=Recipes)
+def create_image_variants(instance, **kwargs):
+    """Варианты пересоздаются, только если картинка сменилась"""
+    if (instance.image.name or '') != instance.variants_image:
+        schedule_variants(refresh_variants, instance.pk)
+
+
+@receiver(post_delete, sender=Recipes)
+def delete_image_variants(instance, **kwargs):
+    if instance.variants_image:
+        schedule_variants(remove_variants, instance.variants_image)
+
+
+@receiver(post_save, sender=Recipes)
+def fan_out_to_timelines(instance, created, **kwargs):
+    if created:
+        schedule(fan_out_recipe, instance.pk)
+
+
+@receiver(post_save, sender=Follow)
+def add_to_timeline(instance, created, **kwargs):
+    if created:
+        schedule(follow_added, instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def remove_from_timeline(instance, **kwargs):
+    if fanout_threshold() is not None:
+        follow_removed(instance.user_id, instance.author_id)
+
+
+@receiver(post_save, sender=ShopCart)
+def add_to_shopping_list(instance, created, **kwargs):
+    if created:
+        add_recipe(instance.user_id, instance.recipes_id)
+
+
+@receiver(pre_delete, sender=ShopCart)
+def remove_from_shopping_list(instance, **kwargs):
+    add_recipe(instance.user_id, instance.recipes_id, sign=-1)
+
+
+def counter_receivers(sender, fk, model, field):
+    """Держит счётчик model.field равным числу связанных sender"""
+
+    def on_save(instance, created, **kwargs):
+        if created:
+            change_counter(model, getattr(instance, f'{fk}_id'), field, 1)
+
+    def on_delete(instance, **kwargs):
+        change_counter(model, getattr(instance, f'{fk}_id'), field, -1)
+
+    uid = f'{sender.__name__}.{fk}->{field}'
+    post_save.connect(on_save, sender=sender, weak=False,
+                      dispatch_uid=f'{uid}:save')
+    post_delete.connect(on_delete, sender=sender, weak=False,
+                        dispatch_uid=f'{uid}:delete')
+
+
+for model, field, sender, fk in COUNTERS:
+    counter_receivers(sender, fk, model, field)
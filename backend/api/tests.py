@@ -0,0 +1,842 @@
+import io
+import json
+from base64 import urlsafe_b64encode
+import tempfile
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import DatabaseError, connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.test import APIClient, APIRequestFactory
+
+from users.models import Follow, User
+from . import replicas
+from .authentication import CachedTokenAuthentication, token_namespace
+from .cache import cached_response, get_version
+from .feed import feed_keys, follow_added
+from .images import refresh_variants, variant_urls
+from .ingredient_index import ingredient_index
+from .management.commands import load_ingredients
+from .middleware import QueryBudgetExceeded
+from .models import (FavoriteUser, Ingredient, IngredientForRecipe, Recipes,
+                     ShopCart, ShoppingListItem, Tags, TimelineEntry)
+from .renderers import ORJSONRenderer
+from .shopping_list import apply_recipe_change
+from .views import RecipesViewSet
+
+
+def create_recipes(author, total, tags, ingredients):
+    Recipes.objects.bulk_create([
+        Recipes(author=author, name=f'Рецепт {i}', image='', text='Текст',
+                cooking_time=10)
+        for i in range(total)
+    ])
+    recipes = list(Recipes.objects.filter(author=author))
+    Recipes.tags.through.objects.bulk_create([
+        Recipes.tags.through(recipes_id=recipe.pk, tags_id=tag.pk)
+        for recipe in recipes for tag in tags
+    ])
+    IngredientForRecipe.objects.bulk_create([
+        IngredientForRecipe(recipe=recipe, ingredients=ingredient, amount=5)
+        for recipe in recipes for ingredient in ingredients
+    ])
+    return recipes
+
+
+class RecipesTestCase(TestCase):
+    """Читатель user, автор author с RECIPES рецептами, TAGS тегами и
+    INGREDIENTS ингредиентами; self.client авторизован читателем"""
+    RECIPES = 0
+    TAGS = 0
+    INGREDIENTS = 0
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='reader',
+                                       email='reader@example.com')
+        cls.author = User.objects.create(username='author',
+                                         email='author@example.com')
+        cls.tags = [Tags.objects.create(name=f'Тег {i}', slug=f'tag{i}',
+                                        color='#000000')
+                    for i in range(cls.TAGS)]
+        cls.ingredients = [
+            Ingredient.objects.create(name=f'Ингредиент {i}',
+                                      measurement_unit='г')
+            for i in range(cls.INGREDIENTS)
+        ]
+        cls.recipes = create_recipes(cls.author, cls.RECIPES, cls.tags,
+                                     cls.ingredients)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+
+class RecipeListQueriesTest(RecipesTestCase):
+    """Число запросов списка рецептов не зависит от размера страницы"""
+    QUERIES = 5
+    RECIPES = 40
+    TAGS = 2
+    INGREDIENTS = 3
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        recipes = list(cls.recipes)
+        for i in range(2):
+            author = User.objects.create(username=f'author{i}',
+                                         email=f'author{i}@example.com')
+            recipes += create_recipes(author, cls.RECIPES, cls.tags,
+                                      cls.ingredients)
+        Follow.objects.create(user=cls.user, author=cls.author)
+        for recipe in recipes[::3]:
+            FavoriteUser.objects.create(user=cls.user, recipes=recipe)
+            ShopCart.objects.create(user=cls.user, recipes=recipe)
+
+    def assert_list_queries(self, client, limit):
+        with self.assertNumQueries(self.QUERIES):
+            response = client.get(f'/api/recipes/?limit={limit}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), limit)
+
+    def test_anonymous(self):
+        for limit in (6, 100):
+            with self.subTest(limit=limit):
+                cache.clear()
+                self.assert_list_queries(APIClient(), limit)
+
+    def test_authenticated(self):
+        for limit in (6, 100):
+            with self.subTest(limit=limit):
+                self.assert_list_queries(self.client, limit)
+
+
+class SubscriptionsRecipesLimitTest(RecipesTestCase):
+    """Некорректный recipes_limit игнорируется"""
+    RECIPES = 5
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        Follow.objects.create(user=cls.user, author=cls.author)
+
+    def get_recipes(self, recipes_limit):
+        response = self.client.get(
+            f'/api/users/subscriptions/?recipes_limit={recipes_limit}'
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.data['results'][0]['recipes']
+
+    def test_valid_limit(self):
+        self.assertEqual(len(self.get_recipes(2)), 2)
+
+    def test_invalid_limit(self):
+        for recipes_limit in ('abc', '-1', '1.5'):
+            with self.subTest(recipes_limit=recipes_limit):
+                self.assertEqual(len(self.get_recipes(recipes_limit)), 5)
+
+
+class LoadIngredientsReadersTest(TestCase):
+    """Разбор файлов ингредиентов"""
+
+    def test_json_small_chunks(self):
+        items = [{'name': f' Ингредиент {i} ', 'measurement_unit': 'г'}
+                 for i in range(50)]
+        content = json.dumps(items, ensure_ascii=False, indent=2)
+        with mock.patch.object(load_ingredients, 'READ_SIZE', 7):
+            rows = list(load_ingredients.iter_json(io.StringIO(content)))
+        self.assertEqual(rows, [(f'Ингредиент {i}', 'г') for i in range(50)])
+
+    def test_json_truncated(self):
+        with self.assertRaises(CommandError):
+            list(load_ingredients.iter_json(
+                io.StringIO('[{"name": "соль", "measurement_unit"')
+            ))
+
+    def test_csv_short_row(self):
+        content = 'соль,г\n\nсахар\n'
+        with self.assertRaisesMessage(CommandError, 'Строка 3'):
+            list(load_ingredients.iter_csv(io.StringIO(content)))
+
+
+class KeysetCursorTest(RecipesTestCase):
+    """Испорченный курсор даёт 404, а не 500"""
+    BAD_VALUES = ([None, 1], ['не дата', 1], ['2022-01-01T00:00:00', 'abc'],
+                  [{}, []], [1], 'строка')
+    RECIPES = 5
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        Follow.objects.create(user=cls.user, author=cls.author)
+
+    @staticmethod
+    def encode(values):
+        return urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+    def test_next_page(self):
+        response = self.client.get('/api/recipes/?pagination=cursor&limit=3')
+        self.assertEqual(len(response.data['results']), 3)
+        response = self.client.get(response.data['next'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 2)
+
+    def test_invalid_cursor(self):
+        urls = ('/api/recipes/?pagination=cursor&cursor={}',
+                '/api/recipes/feed/?cursor={}')
+        cursors = ['%%%', self.encode([1, 2])[:-2]] + [
+            self.encode(values) for values in self.BAD_VALUES
+        ]
+        for url in urls:
+            for cursor in cursors:
+                with self.subTest(url=url, cursor=cursor):
+                    response = self.client.get(url.format(cursor))
+                    self.assertEqual(response.status_code, 404)
+
+    def test_invalid_id_cursor(self):
+        cursor = self.encode(['abc'])
+        response = self.client.get(
+            f'/api/users/subscriptions/?pagination=cursor&cursor={cursor}'
+        )
+        self.assertEqual(response.status_code, 404)
+
+
+class ImageVariantsTest(RecipesTestCase):
+    """Варианты картинки пересоздаются только при её смене"""
+    RECIPES = 1
+
+    def setUp(self):
+        super().setUp()
+        self.recipe, = self.recipes
+
+    def test_urls_only_when_ready(self):
+        self.recipe.image = 'image/cake.png'
+        self.assertIsNone(variant_urls(self.recipe))
+        self.recipe.variants_image = 'image/cake.png'
+        self.assertEqual(variant_urls(self.recipe)['card']['webp'],
+                         '/media/image/variants/cake_card.webp')
+
+    def test_absolute_urls_in_api(self):
+        Recipes.objects.filter(pk=self.recipe.pk).update(
+            image='image/cake.png', variants_image='image/cake.png'
+        )
+        response = self.client.get(f'/api/recipes/{self.recipe.pk}/')
+        self.assertEqual(response.data['image'],
+                         'http://testserver/media/image/cake.png')
+        self.assertEqual(response.data['image_variants']['card']['webp'],
+                         'http://testserver/media/image/variants/'
+                         'cake_card.webp')
+
+    @mock.patch('api.signals.schedule_variants')
+    def test_schedule_on_image_change(self, schedule):
+        self.recipe.name = 'Новое название'
+        self.recipe.save()
+        schedule.assert_not_called()
+        self.recipe.image = 'image/cake.png'
+        self.recipe.save()
+        schedule.assert_called_once_with(refresh_variants, self.recipe.pk)
+
+
+class QueryBudgetTest(RecipesTestCase):
+    """Бюджет запросов по методам и превышение для изменяющих запросов"""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.recipe, = create_recipes(cls.user, 1, [], [])
+
+    @mock.patch.object(RecipesViewSet, 'query_budget', {'GET': 1})
+    def test_raise_for_safe_methods(self):
+        with self.settings(QUERY_BUDGET_RAISE=True):
+            with self.assertRaises(QueryBudgetExceeded):
+                self.client.get('/api/recipes/')
+
+    @mock.patch.object(RecipesViewSet, 'query_budget', {'DELETE': 1})
+    def test_log_for_unsafe_methods(self):
+        with self.settings(QUERY_BUDGET_RAISE=True), \
+                self.assertLogs('api.queries', 'WARNING'):
+            response = self.client.delete(f'/api/recipes/{self.recipe.pk}/')
+        self.assertEqual(response.status_code, 204)
+
+    def test_streaming_without_server_timing(self):
+        response = self.client.get('/api/recipes/download_shopping_cart/')
+        self.assertTrue(response.streaming)
+        self.assertNotIn('Server-Timing', response)
+
+
+class CounterDriftTest(RecipesTestCase):
+    """Сохранение устаревшего экземпляра не затирает счётчики"""
+    RECIPES = 1
+
+    def test_stale_recipe(self):
+        recipe, = self.recipes
+        stale = Recipes.objects.get(pk=recipe.pk)
+        FavoriteUser.objects.create(user=self.user, recipes=recipe)
+        ShopCart.objects.create(user=self.user, recipes=recipe)
+        stale.name = 'Новое название'
+        stale.save()
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.name, 'Новое название')
+        self.assertEqual(recipe.favorites_count, 1)
+        self.assertEqual(recipe.in_carts_count, 1)
+
+    def test_stale_user(self):
+        stale = User.objects.get(pk=self.author.pk)
+        Follow.objects.create(user=self.user, author=self.author)
+        stale.first_name = 'Автор'
+        stale.save()
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.first_name, 'Автор')
+        self.assertEqual(self.author.followers_count, 1)
+
+
+class IngredientForRecipeAdminTest(RecipesTestCase):
+    """Правка ингредиентов рецепта в админке обновляет списки покупок"""
+    RECIPES = 1
+    INGREDIENTS = 1
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.admin = User.objects.create(username='admin',
+                                        email='admin@example.com',
+                                        is_staff=True, is_superuser=True)
+        cls.recipe, = cls.recipes
+        cls.ingredient, = cls.ingredients
+        ShopCart.objects.create(user=cls.user, recipes=cls.recipe)
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.admin)
+        self.row = IngredientForRecipe.objects.get(recipe=self.recipe)
+
+    def shopping_list(self):
+        return list(ShoppingListItem.objects.filter(
+            user=self.user
+        ).values_list('ingredient_id', 'amount'))
+
+    def test_change(self):
+        updated_at = Recipes.objects.get(pk=self.recipe.pk).updated_at
+        self.client.post(
+            f'/admin/api/ingredientforrecipe/{self.row.pk}/change/',
+            {'recipe': self.recipe.pk, 'ingredients': self.ingredient.pk,
+             'amount': 12}
+        )
+        self.assertEqual(self.shopping_list(), [(self.ingredient.pk, 12)])
+        self.assertGreater(Recipes.objects.get(pk=self.recipe.pk).updated_at,
+                           updated_at)
+
+    def test_bulk_delete(self):
+        self.client.post('/admin/api/ingredientforrecipe/', {
+            'action': 'delete_selected', '_selected_action': [self.row.pk],
+            'post': 'yes',
+        })
+        self.assertFalse(IngredientForRecipe.objects.exists())
+        self.assertEqual(self.shopping_list(), [])
+
+
+class SharedCacheFillTest(TestCase):
+    """Общий кеш заполняется чтением с основной базы"""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_cached_response_reads_primary(self):
+        reads = []
+
+        def build():
+            reads.append(replicas.state.replica)
+            return Response([])
+
+        request = APIRequestFactory().get('/api/recipes/')
+        with replicas.read_from_replica():
+            cached_response(request, 'test-key', build)
+        self.assertEqual(reads, [False])
+
+    def test_ingredient_index_reads_primary(self):
+        reads = []
+
+        def db_for_read(router, model, **hints):
+            reads.append(replicas.state.replica)
+            return 'default'
+
+        with mock.patch.object(replicas.ReplicaRouter, 'db_for_read',
+                               db_for_read), replicas.read_from_replica():
+            ingredient_index.build()
+        self.assertEqual(reads, [False])
+
+
+class CachedTokenAuthenticationTest(RecipesTestCase):
+    """Кеш токенов: свежий пользователь для записи, сброс по токену"""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.token = Token.objects.create(user=cls.user)
+        cls.key = cls.token.key
+
+    def setUp(self):
+        super().setUp()
+        CachedTokenAuthentication.local.clear()
+
+    def authenticate(self, method='get'):
+        request = getattr(APIRequestFactory(), method)(
+            '/', HTTP_AUTHORIZATION=f'Token {self.token.key}'
+        )
+        authentication = CachedTokenAuthentication()
+        user, _ = authentication.authenticate(Request(request))
+        return user, authentication.source
+
+    def version(self):
+        return get_version(token_namespace(self.key))
+
+    def token_client(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {self.key}')
+        self.assertEqual(client.get('/api/users/me/').status_code, 200)
+        return client
+
+    def test_cached_user_for_toggles(self):
+        self.assertEqual(self.authenticate()[1], 'miss')
+        Follow.objects.create(user=self.author, author=self.user)
+        user, source = self.authenticate('post')
+        self.assertEqual((source, user.followers_count), ('local', 0))
+        recipe, = create_recipes(self.author, 1, [], [])
+        client = self.token_client()
+        with CaptureQueriesContext(connection) as queries:
+            response = client.post(f'/api/recipes/{recipe.pk}/favorite/')
+            self.assertEqual(response.status_code, 201)
+            response = client.delete(f'/api/recipes/{recipe.pk}/favorite/')
+            self.assertEqual(response.status_code, 204)
+        self.assertFalse([query for query in queries.captured_queries
+                          if 'FROM "users_user"' in query['sql']])
+
+    def test_fresh_user_for_set_password(self):
+        user = User.objects.get(pk=self.user.pk)
+        user.set_password('old-password-1')
+        user.save()
+        client = self.token_client()
+        User.objects.filter(pk=user.pk).update(first_name='Читатель')
+        response = client.post('/api/users/set_password/', {
+            'current_password': 'old-password-1',
+            'new_password': 'new-password-1',
+        })
+        self.assertEqual(response.status_code, 204)
+        user.refresh_from_db()
+        self.assertEqual(user.first_name, 'Читатель')
+        self.assertTrue(user.check_password('new-password-1'))
+
+    @mock.patch('api.signals.transaction.on_commit', lambda func: func())
+    def test_version_bumps(self):
+        version = self.version()
+        self.author.set_password('new-password')
+        self.author.save()
+        self.user.first_name = 'Читатель'
+        self.user.save()
+        self.assertEqual(self.version(), version)
+        self.user.set_password('new-password')
+        self.user.save()
+        self.assertNotEqual(self.version(), version)
+        version = self.version()
+        self.token.delete()
+        self.assertNotEqual(self.version(), version)
+
+
+class BulkCartTest(RecipesTestCase):
+    """Массовое добавление и удаление обновляет счётчики и список покупок"""
+    RECIPES = 3
+    INGREDIENTS = 1
+
+    def setUp(self):
+        super().setUp()
+        self.ids = [recipe.pk for recipe in self.recipes]
+
+    def send(self, method, ids):
+        response = getattr(self.client, method)(
+            '/api/recipes/shopping_cart/', {'recipes': ids}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        return [item['status'] for item in response.data['results']]
+
+    def test_add_and_remove(self):
+        self.assertEqual(self.send('post', self.ids), ['added'] * 3)
+        self.assertEqual(
+            ShoppingListItem.objects.get(user=self.user).amount, 15
+        )
+        missing = max(self.ids) + 1
+        self.assertEqual(self.send('delete', self.ids[:2] + [missing]),
+                         ['removed', 'removed', 'absent'])
+        self.assertEqual(
+            ShoppingListItem.objects.get(user=self.user).amount, 5
+        )
+        self.assertEqual(
+            dict(Recipes.objects.values_list('pk', 'in_carts_count')),
+            {self.ids[0]: 0, self.ids[1]: 0, self.ids[2]: 1}
+        )
+        self.assertEqual(ShopCart.objects.get().recipes_id, self.ids[2])
+
+
+@override_settings(FEED_FANOUT_THRESHOLD=2, FEED_TIMELINE_DEPTH=10)
+class FeedFanoutTest(RecipesTestCase):
+    """Автор раскладывается по лентам после перехода порога"""
+    RECIPES = 3
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.readers = [cls.user] + [
+            User.objects.create(username=f'reader{i}',
+                                email=f'reader{i}@example.com')
+            for i in range(2)
+        ]
+        for reader in cls.readers:
+            Follow.objects.create(user=reader, author=cls.author)
+
+    def feed(self, user):
+        return [pk for _, pk in feed_keys(user, None, 10)]
+
+    def test_join_until_flag(self):
+        expected = [recipe.pk for recipe in self.recipes]
+        for reader in self.readers:
+            self.assertEqual(self.feed(reader), expected)
+
+    def test_threshold_crossed_past_equality(self):
+        follow_added(self.readers[-1].pk, self.author.pk)
+        self.author.refresh_from_db()
+        self.assertTrue(self.author.feed_fanout)
+        self.assertEqual(TimelineEntry.objects.count(), 9)
+        expected = [recipe.pk for recipe in self.recipes]
+        for reader in self.readers:
+            self.assertEqual(self.feed(reader), expected)
+
+
+class RecipeConditionalGetTest(RecipesTestCase):
+    """Условный GET рецепта учитывает флаги пользователя"""
+    RECIPES = 1
+
+    def setUp(self):
+        super().setUp()
+        self.recipe, = self.recipes
+        self.url = f'/api/recipes/{self.recipe.pk}/'
+
+    def test_anonymous_last_modified(self):
+        client = APIClient()
+        response = client.get(self.url)
+        self.assertIn('Last-Modified', response)
+        response = client.get(
+            self.url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']
+        )
+        self.assertEqual(response.status_code, 304)
+
+    def test_authenticated_flags(self):
+        response = self.client.get(self.url)
+        self.assertNotIn('Last-Modified', response)
+        etag = response['ETag']
+        FavoriteUser.objects.create(user=self.user, recipes=self.recipe)
+        response = self.client.get(
+            self.url, HTTP_IF_NONE_MATCH=etag,
+            HTTP_IF_MODIFIED_SINCE='Sun, 18 Oct 2099 00:00:00 GMT'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['is_favorited'])
+
+
+class TouchRecipesTest(RecipesTestCase):
+    """updated_at сдвигается в той же транзакции и один раз на рецепт"""
+    RECIPES = 2
+    INGREDIENTS = 3
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.tag = Tags.objects.create(name='Тег', slug='tag',
+                                      color='#000000')
+
+    def updated_at(self):
+        return dict(Recipes.objects.values_list('pk', 'updated_at'))
+
+    def recipe_updates(self, queries):
+        return [query for query in queries.captured_queries
+                if query['sql'].startswith('UPDATE "api_recipes"')]
+
+    def test_delete_recipe_without_updates(self):
+        with CaptureQueriesContext(connection) as queries:
+            Recipes.objects.get(pk=self.recipes[0].pk).delete()
+        self.assertEqual(self.recipe_updates(queries), [])
+
+    def test_reverse_tags(self):
+        before = self.updated_at()
+        with CaptureQueriesContext(connection) as queries:
+            self.tag.recipes.add(*self.recipes)
+        self.assertEqual(len(self.recipe_updates(queries)), 1)
+        after = self.updated_at()
+        for recipe in self.recipes:
+            self.assertGreater(after[recipe.pk], before[recipe.pk])
+
+    def test_rollback(self):
+        before = self.updated_at()
+        try:
+            with transaction.atomic():
+                self.tag.recipes.add(*self.recipes)
+                raise DatabaseError
+        except DatabaseError:
+            pass
+        self.assertEqual(self.updated_at(), before)
+
+
+class ORJSONRendererTest(TestCase):
+    """ORJSONRenderer отдаёт то же, что JSONRenderer"""
+
+    def render(self, renderer, data):
+        return renderer.render(data, 'application/json', {})
+
+    def test_same_output(self):
+        data = {
+            'id': 1,
+            'name': 'Борщ\u2028',
+            'amount': 1.5,
+            'tags': [{'slug': 'soup'}, None],
+            1: True,
+        }
+        self.assertEqual(self.render(ORJSONRenderer(), data),
+                         self.render(JSONRenderer(), data))
+
+    def test_non_finite_is_null(self):
+        for value in (float('nan'), float('inf'), float('-inf')):
+            data = {'results': [{'amount': value}]}
+            with self.subTest(value=value):
+                with self.assertRaises(ValueError):
+                    self.render(JSONRenderer(), data)
+                self.assertEqual(self.render(ORJSONRenderer(), data),
+                                 b'{"results":[{"amount":null}]}')
+
+
+class RecipeIngredientsCartTest(RecipesTestCase):
+    """Правка ингредиентов рецепта доходит до списков покупок"""
+    INGREDIENTS = 1
+
+    def test_first_ingredient(self):
+        recipe = create_recipes(self.user, 1, [], [])[0]
+        ShopCart.objects.create(user=self.author, recipes=recipe)
+        ingredient, = self.ingredients
+        response = self.client.patch(
+            f'/api/recipes/{recipe.pk}/',
+            {'ingredients': [{'id': ingredient.pk, 'amount': 7}]},
+            format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            list(ShoppingListItem.objects.filter(
+                user=self.author
+            ).values_list('ingredient_id', 'amount')),
+            [(ingredient.pk, 7)]
+        )
+
+
+class LoadIngredientsCacheTest(RecipesTestCase):
+    """Загрузка каталога сбрасывает кеш рецептов для анонимов"""
+    RECIPES = 1
+    INGREDIENTS = 1
+
+    def units(self, client):
+        recipe, = self.recipes
+        response = client.get(f'/api/recipes/{recipe.pk}/')
+        return [item['measurement_unit']
+                for item in response.data['ingredients']]
+
+    def test_changed_unit(self):
+        client = APIClient()
+        self.assertEqual(self.units(client), ['г'])
+        with tempfile.NamedTemporaryFile('w', suffix='.csv') as file:
+            file.write('Ингредиент 0,кг\n')
+            file.flush()
+            call_command('load_ingredients', file.name, stdout=io.StringIO())
+        self.assertEqual(self.units(client), ['кг'])
+
+
+class RecipesAdminCartTest(RecipesTestCase):
+    """Форма рецепта в админке меняет списки покупок только на разницу"""
+    RECIPES = 1
+    TAGS = 1
+    INGREDIENTS = 2
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.admin = User.objects.create(username='admin',
+                                        email='admin@example.com',
+                                        is_staff=True, is_superuser=True)
+        cls.recipe, = cls.recipes
+        Recipes.objects.filter(pk=cls.recipe.pk).update(image='image/a.png')
+        ShopCart.objects.create(user=cls.user, recipes=cls.recipe)
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.admin)
+
+    def post(self, amounts, name='Рецепт', delete=()):
+        rows = list(IngredientForRecipe.objects.filter(
+            recipe=self.recipe
+        ).order_by('pk'))
+        data = {
+            'author': self.author.pk, 'name': name, 'text': 'Текст',
+            'cooking_time': 10, 'tags': [tag.pk for tag in self.tags],
+            'recipes-TOTAL_FORMS': len(rows) + 1,
+            'recipes-INITIAL_FORMS': len(rows),
+            'recipes-MIN_NUM_FORMS': 0, 'recipes-MAX_NUM_FORMS': 1000,
+        }
+        for index, row in enumerate(rows):
+            data.update({
+                f'recipes-{index}-id': row.pk,
+                f'recipes-{index}-recipe': self.recipe.pk,
+                f'recipes-{index}-ingredients': row.ingredients_id,
+                f'recipes-{index}-amount': amounts[index],
+            })
+            if index in delete:
+                data[f'recipes-{index}-DELETE'] = 'on'
+        response = self.client.post(
+            f'/admin/api/recipes/{self.recipe.pk}/change/', data
+        )
+        self.assertEqual(response.status_code, 302)
+
+    def shopping_list(self):
+        return dict(ShoppingListItem.objects.filter(
+            user=self.user
+        ).values_list('ingredient_id', 'amount'))
+
+    def test_name_only(self):
+        with mock.patch('api.admin.apply_recipe_change') as apply, \
+                mock.patch('api.admin.rebuild') as rebuild:
+            self.post([5, 5], name='Новое название')
+        apply.assert_not_called()
+        rebuild.assert_not_called()
+        self.assertEqual(Recipes.objects.get(pk=self.recipe.pk).name,
+                         'Новое название')
+
+    def test_changed_row(self):
+        first, second = self.ingredients
+        with mock.patch('api.admin.apply_recipe_change',
+                        wraps=apply_recipe_change) as apply:
+            self.post([8, 5])
+        apply.assert_called_once_with(self.recipe.pk, {first.pk: 3})
+        self.assertEqual(self.shopping_list(), {first.pk: 8, second.pk: 5})
+
+    def test_deleted_row(self):
+        first, second = self.ingredients
+        self.post([5, 5], delete=(1,))
+        self.assertEqual(self.shopping_list(), {first.pk: 5})
+
+
+class RecipeUpdateTest(RecipesTestCase):
+    """Правка рецепта: ошибка ничего не меняет, запросов не больше
+    при длинном списке ингредиентов"""
+    TAGS = 2
+    INGREDIENTS = 41
+
+    def create_recipe(self, total):
+        recipe = Recipes.objects.create(author=self.user, name='Рецепт',
+                                        image='', text='Текст',
+                                        cooking_time=10)
+        recipe.tags.set(self.tags[:1])
+        IngredientForRecipe.objects.bulk_create([
+            IngredientForRecipe(recipe=recipe, ingredients=ingredient,
+                                amount=5)
+            for ingredient in self.ingredients[:total]
+        ])
+        return recipe
+
+    def state(self, recipe):
+        return (
+            list(recipe.tags.values_list('pk', flat=True)),
+            list(IngredientForRecipe.objects.filter(
+                recipe=recipe
+            ).order_by('ingredients_id').values_list(
+                'ingredients_id', 'amount'
+            )),
+        )
+
+    def patch(self, recipe, data):
+        return self.client.patch(f'/api/recipes/{recipe.pk}/', data,
+                                 format='json')
+
+    def test_invalid_payload(self):
+        recipe = self.create_recipe(3)
+        before = self.state(recipe)
+        missing = max(ingredient.pk for ingredient in self.ingredients) + 1
+        response = self.patch(recipe, {
+            'tags': [self.tags[1].pk],
+            'ingredients': [{'id': self.ingredients[0].pk, 'amount': 1},
+                            {'id': missing, 'amount': 1}],
+        })
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.state(recipe), before)
+
+    def test_bounded_statements(self):
+        counts = []
+        for total in (4, 40):
+            recipe = self.create_recipe(total)
+            ingredients = self.ingredients[1:total + 1]
+            with CaptureQueriesContext(connection) as queries:
+                response = self.patch(recipe, {
+                    'tags': [self.tags[1].pk],
+                    'ingredients': [
+                        {'id': ingredient.pk, 'amount': 7}
+                        for ingredient in ingredients
+                    ],
+                })
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(
+                self.state(recipe)[1],
+                [(ingredient.pk, 7) for ingredient in ingredients]
+            )
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+
+class SparseFieldsQueriesTest(RecipesTestCase):
+    """Список без полей-связей не читает их таблицы"""
+    RECIPES = 3
+    TAGS = 1
+    INGREDIENTS = 2
+    CASES = (
+        ('fields=name,image,cooking_time',
+         {'id', 'name', 'image', 'cooking_time'},
+         ('api_ingredientforrecipe', 'users_follow', 'api_tags')),
+        ('omit=author', None, ('users_follow',)),
+    )
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        Follow.objects.create(user=cls.user, author=cls.author)
+
+    def assert_tables_untouched(self, client):
+        for query, keys, tables in self.CASES:
+            with self.subTest(query=query):
+                cache.clear()
+                with CaptureQueriesContext(connection) as queries:
+                    response = client.get(f'/api/recipes/?{query}')
+                self.assertEqual(response.status_code, 200)
+                result = response.data['results'][0]
+                if keys is not None:
+                    self.assertEqual(set(result), keys)
+                else:
+                    self.assertNotIn('author', result)
+                sql = ' '.join(query['sql'] for query
+                               in queries.captured_queries)
+                for table in tables:
+                    self.assertNotIn(f'"{table}"', sql)
+
+    def test_anonymous(self):
+        self.assert_tables_untouched(APIClient())
+
+    def test_authenticated(self):
+        self.assert_tables_untouched(self.client)
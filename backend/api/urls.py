@@ -2,7 +2,8 @@ from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .views import RecipesViewSet, TagsViewSet, IngredientViewSet, \
     FavoriteViewSet, FollowListView, FollowViewSet, \
-    DownloadListView, AddCartViewSet, CreateUserView
+    DownloadListView, AddCartViewSet, CreateUserView, BulkFavoriteView, \
+    BulkCartView, FeedView
 
 app_name = 'api'
 
@@ -16,6 +17,11 @@ router.register('users', CreateUserView, basename='users')
 urlpatterns = [
     path('users/subscriptions/', FollowListView.as_view()),
     path('recipes/download_shopping_cart/', DownloadListView.as_view()),
+    path('recipes/feed/', FeedView.as_view(), name='feed'),
+    path('recipes/favorite/', BulkFavoriteView.as_view(),
+         name='favorite_bulk'),
+    path('recipes/shopping_cart/', BulkCartView.as_view(),
+         name='shopping_cart_bulk'),
     path('', include(router.urls)),
     path('recipes/<int:recipes_id>/shopping_cart/', AddCartViewSet.as_view(),
          name='shopping_cart'),
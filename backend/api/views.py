@@ -1,27 +1,123 @@
-from django.http import HttpResponse
+from django.db import connection, transaction
+from django.db.models import Exists, F, OuterRef, Prefetch, Window
+from django.db.models.functions import RowNumber
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet
 from rest_framework import viewsets, filters, status
 from rest_framework.generics import ListAPIView
 from rest_framework.permissions import IsAuthenticatedOrReadOnly, \
-    AllowAny, IsAuthenticated
+    AllowAny, IsAuthenticated, SAFE_METHODS
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.viewsets import ReadOnlyModelViewSet
+from .authentication import CachedTokenAuthentication
+from .cache import AnonymousCacheMixin, CachedListMixin, get_version
 from .filter import FilterRecipe
+from .ingredient_index import ingredient_index
+from .feed import feed_keys
+from .pagination import FeedPagination, PageOrKeysetPagination
 from .models import Recipes, Tags, Ingredient, FavoriteUser, ShopCart, \
     IngredientForRecipe
 from users.models import User, Follow
+from .counters import change_counters
+from .shopping_list import SHOPPING_LIST_FORMATS, add_recipes, \
+    apply_recipe_change, get_shopping_list, stream_shopping_list
 from .serializers import RecipesSerializer, TagsSerializer, \
     IngredientSerializer, FavoriteSerializer, \
     FollowUserSerializer, ShoppingSerializer, \
-    RecipeSerializerPost, CustomUserSerializer
+    RecipeSerializerPost, CustomUserSerializer, BulkRecipesSerializer, \
+    get_recipes_limit, sparse_fields
+
+
+def annotate_is_following(queryset, user):
+    """Добавляет пользователям флаг подписки текущего пользователя"""
+    if user.is_anonymous:
+        return queryset
+    return queryset.annotate(is_following=Exists(
+        Follow.objects.filter(user=user, author=OuterRef('pk'))
+    ))
+
+
+def recipes_queryset(user, fields=None):
+    """Рецепты со всем, что нужно RecipesSerializer, за фиксированное
+    число запросов
+
+    fields - поля ответа (см. sparse_fields), для остальных связи не
+    подгружаются и флаги не считаются.
+    """
+    if fields is None:
+        fields = set(RecipesSerializer.Meta.fields)
+    deferred = ['search_vector']
+    if 'text' not in fields:
+        deferred.append('text')
+    prefetches = []
+    if 'tags' in fields:
+        prefetches.append('tags')
+    if 'author' in fields:
+        prefetches.append(Prefetch(
+            'author',
+            queryset=annotate_is_following(User.objects.all(), user)
+        ))
+    if 'ingredients' in fields:
+        prefetches.append(Prefetch(
+            'recipes',
+            queryset=IngredientForRecipe.objects.select_related(
+                'ingredients'
+            )
+        ))
+    queryset = Recipes.objects.defer(*deferred).prefetch_related(
+        *prefetches
+    )
+    if user.is_anonymous:
+        return queryset
+    if 'is_favorited' in fields:
+        queryset = queryset.annotate(
+            is_favorited=Exists(FavoriteUser.objects.filter(
+                user=user, recipes=OuterRef('pk')
+            ))
+        )
+    if 'is_in_shopping_cart' in fields:
+        queryset = queryset.annotate(
+            is_in_shopping_cart=Exists(ShopCart.objects.filter(
+                user=user, recipes=OuterRef('pk')
+            ))
+        )
+    return queryset
+
+
+def limit_recipes_per_author(queryset, limit):
+    """Оставляет не больше limit новых рецептов каждого автора"""
+    ranked = queryset.annotate(row_number=Window(
+        expression=RowNumber(),
+        partition_by=[F('author')],
+        order_by=[F('pub_date').desc(), F('id').desc()],
+    )).order_by().values('id', 'row_number')
+    sql, params = ranked.query.sql_with_params()
+    return queryset.extra(
+        where=[f'{Recipes._meta.db_table}.id IN (SELECT id FROM ({sql}) '
+               f'ranked WHERE row_number <= %s)'],
+        params=[*params, limit]
+    )
 
 
 class CreateUserView(UserViewSet):
     """Просмотр пользователей"""
     serializer_class = CustomUserSerializer
+    # Действия, которые сохраняют строку request.user: пользователь из кеша
+    # токенов может отставать, поэтому для них он перечитывается из БД
+    saves_current_user = ('me', 'set_password', 'set_username')
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if self.action in self.saves_current_user \
+                and request.method not in SAFE_METHODS:
+            request.user = CachedTokenAuthentication.fresh_user(
+                request.user.pk
+            )
 
     def get_queryset(self):
         return User.objects.all()
@@ -75,48 +171,58 @@ class FollowViewSet(APIView):
 class FollowListView(ListAPIView):
     """Просмотр подписок"""
     serializer_class = FollowUserSerializer
+    pagination_class = PageOrKeysetPagination
+    cursor_ordering = ('id',)
+    query_budget = 6
 
     def get_queryset(self):
-        return User.objects.filter(following__user=self.request.user)
+        user = self.request.user
+        recipes = Recipes.objects.filter(author__following__user=user)
+        recipes_limit = get_recipes_limit(self.request)
+        if recipes_limit is not None:
+            recipes = limit_recipes_per_author(recipes, recipes_limit)
+        return User.objects.filter(following__user=user).prefetch_related(
+            Prefetch('recipes', queryset=recipes)
+        ).order_by('id')
+
+
+class FeedView(ListAPIView):
+    """Лента рецептов авторов, на которых подписан пользователь"""
+    permission_classes = [IsAuthenticated, ]
+    serializer_class = RecipesSerializer
+    pagination_class = FeedPagination
+    query_budget = 7
+
+    def get_queryset(self):
+        return recipes_queryset(
+            self.request.user,
+            sparse_fields(self.request, RecipesSerializer.Meta.fields)
+        )
+
+    def feed_keys(self, position, limit):
+        return feed_keys(self.request.user, position, limit)
 
 
 class DownloadListView(APIView):
     """Загрузка списка покупок"""
     permission_classes = [IsAuthenticated, ]
+    query_budget = 3
 
     def get(self, request):
-        user = request.user
-        shopping_cart = user.user.all()
-        buy_list = {}
-        shop_list = []
-        for record in shopping_cart:
-            recipe = record.recipes
-            ingredients = IngredientForRecipe.objects.filter(recipe=recipe)
-            if ingredients is None:
-                return Response(
-                    'Ингридиентов нет! Добавь хоть один',
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            for ingredient in ingredients:
-                amount = ingredient.amount
-                name = ingredient.ingredients.name
-                measurement_unit = ingredient.ingredients.measurement_unit
-                if name not in buy_list:
-                    buy_list[name] = {
-                        'measurement_unit': measurement_unit,
-                        'amount': amount
-                    }
-                else:
-                    buy_list[name]['amount'] = (buy_list[name]['amount']
-                                                + amount)
-        shop_list.append('Список ваших покупок: ')
-        for item in buy_list:
-            shop_list.append(f'{item} - {buy_list[item]["amount"]} '
-                             f'{buy_list[item]["measurement_unit"]};')
-        shop_list.append(' ')
-        shop_list.append('- Ваш сервис рецептов Foodgram')
-        response = HttpResponse(shop_list, 'Content-Type: text/plain')
-        response['Content-Disposition'] = 'attachment; filename="BuyList.txt"'
+        file_format = request.query_params.get('file_format', 'txt')
+        if file_format not in SHOPPING_LIST_FORMATS:
+            return Response(
+                {'file_format': 'Доступные форматы: '
+                                + ', '.join(SHOPPING_LIST_FORMATS)},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        content_type, filename = SHOPPING_LIST_FORMATS[file_format]
+        rows = get_shopping_list(request.user).iterator()
+        response = StreamingHttpResponse(
+            stream_shopping_list(rows, file_format),
+            content_type=content_type
+        )
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
         return response
 
 
@@ -124,11 +230,7 @@ class AddCartViewSet(APIView):
     """Добавить и удалить из покупки"""
 
     def post(self, request, recipes_id):
-        user = request.user
-        data = {
-            'recipes': recipes_id,
-            'user': user.id
-        }
+        data = {'recipes': recipes_id}
         serializer = ShoppingSerializer(data=data,
                                         context={'request': request})
         serializer.is_valid(raise_exception=True)
@@ -146,11 +248,7 @@ class FavoriteViewSet(APIView):
     """Добавить в избранное"""
 
     def post(self, request, recipes_id):
-        user = request.user
-        data = {
-            'recipes': recipes_id,
-            'user': user.id
-        }
+        data = {'recipes': recipes_id}
         serializer = FavoriteSerializer(data=data,
                                         context={'request': request})
         serializer.is_valid(raise_exception=True)
@@ -164,8 +262,108 @@ class FavoriteViewSet(APIView):
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class IngredientViewSet(ReadOnlyModelViewSet):
+class BulkRecipesView(APIView):
+    """Добавить или убрать сразу несколько рецептов
+
+    Тело запроса {"recipes": [id, ...]}, в ответе статус по каждому id.
+    Вместо сигналов на каждую строку счётчики (и список покупок) меняются
+    одним запросом на всю пачку.
+    """
+    permission_classes = [IsAuthenticated, ]
+    model = None
+    counter = None
+    query_budget = {'POST': 11, 'DELETE': 10}
+
+    def get_recipe_ids(self, request):
+        serializer = BulkRecipesSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data['recipes']
+
+    def get_present(self, user, recipe_ids):
+        """Блокирует пользователя (единственный раз за запрос) и возвращает
+        уже добавленные рецепты"""
+        list(User.objects.select_for_update().filter(
+            pk=user.pk
+        ).values_list('pk'))
+        return set(self.model.objects.filter(
+            user=user, recipes__in=recipe_ids
+        ).values_list('recipes_id', flat=True))
+
+    def changed(self, user, recipe_ids, sign):
+        change_counters(Recipes, recipe_ids, self.counter, sign)
+
+    def remove(self, user, recipe_ids):
+        """Удаляет строки одним DELETE без сигналов на каждую строку
+
+        Всё, что сделали бы сигналы (счётчики, список покупок), делает
+        changed() сразу для всей пачки.
+        """
+        self.changed(user, recipe_ids, -1)
+        meta = self.model._meta
+        placeholders = ', '.join(['%s'] * len(recipe_ids))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {meta.db_table} '
+                f'WHERE {meta.get_field("user").column} = %s '
+                f'AND {meta.get_field("recipes").column} '
+                f'IN ({placeholders})',
+                [user.pk, *recipe_ids]
+            )
+
+    @transaction.atomic
+    def post(self, request):
+        user = request.user
+        recipe_ids = self.get_recipe_ids(request)
+        found = set(Recipes.objects.filter(
+            pk__in=recipe_ids
+        ).values_list('id', flat=True))
+        present = self.get_present(user, found)
+        added = [pk for pk in recipe_ids if pk in found and pk not in present]
+        if added:
+            self.model.objects.bulk_create([
+                self.model(user=user, recipes_id=pk) for pk in added
+            ], ignore_conflicts=True)
+            self.changed(user, added, 1)
+        results = [
+            {'id': pk, 'status': 'added' if pk in added
+             else 'exists' if pk in present else 'not_found'}
+            for pk in recipe_ids
+        ]
+        return Response({'results': results})
+
+    @transaction.atomic
+    def delete(self, request):
+        user = request.user
+        recipe_ids = self.get_recipe_ids(request)
+        present = self.get_present(user, recipe_ids)
+        if present:
+            self.remove(user, sorted(present))
+        results = [
+            {'id': pk, 'status': 'removed' if pk in present else 'absent'}
+            for pk in recipe_ids
+        ]
+        return Response({'results': results})
+
+
+class BulkFavoriteView(BulkRecipesView):
+    """Массово добавить и удалить из избранного"""
+    model = FavoriteUser
+    counter = 'favorites_count'
+
+
+class BulkCartView(BulkRecipesView):
+    """Массово добавить и удалить из покупок"""
+    model = ShopCart
+    counter = 'in_carts_count'
+
+    def changed(self, user, recipe_ids, sign):
+        super().changed(user, recipe_ids, sign)
+        add_recipes(user.pk, recipe_ids, sign, locked=True)
+
+
+class IngredientViewSet(CachedListMixin, ReadOnlyModelViewSet):
     """Просмотр ингридиентов"""
+    cache_namespace = 'ingredients'
     permission_classes = (AllowAny,)
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
@@ -173,67 +371,184 @@ class IngredientViewSet(ReadOnlyModelViewSet):
     pagination_class = None
     search_fields = ['^name', ]
 
+    def list(self, request, *args, **kwargs):
+        name = request.query_params.get('name')
+        if name is None:
+            return super().list(request, *args, **kwargs)
+        limit = request.query_params.get('limit')
+        limit = int(limit) if limit and limit.isdigit() else None
+        return Response(ingredient_index.search(name, limit))
 
-class TagsViewSet(viewsets.ReadOnlyModelViewSet):
+
+class TagsViewSet(CachedListMixin, viewsets.ReadOnlyModelViewSet):
     """Просмотр тегов"""
+    cache_namespace = 'tags'
     pagination_class = None
     permission_class = None
     queryset = Tags.objects.all()
     serializer_class = TagsSerializer
 
 
-class RecipesViewSet(viewsets.ModelViewSet):
+class RecipesViewSet(AnonymousCacheMixin, viewsets.ModelViewSet):
     """Просмотр и работы с рецептами"""
+    cache_namespace = 'recipes'
+    cache_params = ('tags', 'author', 'is_favorited', 'is_in_shopping_cart',
+                    'search', 'page', 'limit', 'pagination', 'cursor',
+                    'fields', 'omit')
     filter_backends = [DjangoFilterBackend, ]
     filterset_class = FilterRecipe
     permission_classes = [IsAuthenticatedOrReadOnly]
+    pagination_class = PageOrKeysetPagination
+    cursor_ordering = ('-pub_date', '-id')
+    query_budget = {'GET': 8, 'HEAD': 8, 'POST': 20, 'PUT': 30, 'PATCH': 30,
+                    'DELETE': 30}
     queryset = Recipes.objects.all()
 
+    def get_queryset(self):
+        return recipes_queryset(
+            self.request.user,
+            sparse_fields(self.request, RecipesSerializer.Meta.fields)
+        )
+
     def get_serializer_class(self):
         if self.request.method == 'GET':
             return RecipesSerializer
         return RecipeSerializerPost
 
-    def create_tags(self, tags, recipes):
-        for tag in tags:
-            recipes.tags.add(tag)
+    def get_validators(self, pk):
+        """ETag и Last-Modified рецепта одним запросом, без сериализации
 
+        В ETag входят updated_at, версия связанных данных (теги,
+        ингредиенты, авторы) и флаги текущего пользователя. Флаги меняются
+        без updated_at, поэтому авторизованным Last-Modified не отдаётся:
+        иначе запрос только с If-Modified-Since получил бы 304 со старыми
+        флагами.
+        """
+        if not str(pk).isdigit():
+            return None
+        user = self.request.user
+        queryset = Recipes.objects.filter(pk=pk)
+        flags = ()
+        if not user.is_anonymous:
+            queryset = queryset.annotate(
+                is_favorited=Exists(FavoriteUser.objects.filter(
+                    user=user, recipes=OuterRef('pk')
+                )),
+                is_in_shopping_cart=Exists(ShopCart.objects.filter(
+                    user=user, recipes=OuterRef('pk')
+                )),
+                is_following=Exists(Follow.objects.filter(
+                    user=user, author=OuterRef('author')
+                )),
+            )
+            flags = ('is_favorited', 'is_in_shopping_cart', 'is_following')
+        row = queryset.values('updated_at', *flags).first()
+        if row is None:
+            return None
+        updated_at = row['updated_at']
+        state = ''.join('1' if row[flag] else '0' for flag in flags)
+        fields = sparse_fields(self.request, RecipesSerializer.Meta.fields)
+        if fields != set(RecipesSerializer.Meta.fields):
+            state += '-' + ','.join(sorted(fields))
+        etag = 'W/' + quote_etag(
+            f'{pk}-{int(updated_at.timestamp() * 1000000)}-'
+            f'{get_version("recipes-deps")}-{state}'
+        )
+        if flags:
+            return etag, None
+        return etag, int(updated_at.timestamp())
+
+    def retrieve(self, request, *args, **kwargs):
+        validators = self.get_validators(kwargs.get('pk'))
+        if validators is None:
+            return super().retrieve(request, *args, **kwargs)
+        etag, last_modified = validators
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified
+        )
+        if response is None:
+            response = super().retrieve(request, *args, **kwargs)
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+        patch_vary_headers(response, ('Authorization',))
+        return response
+
+    @staticmethod
+    def set_ingredients(recipe, ingredients, created=False):
+        """Приводит ингредиенты рецепта к переданным, меняя только разницу
+
+        У только что созданного рецепта покупателей нет, списки покупок
+        не трогаются.
+        """
+        amounts = {item['id'].id: item['amount'] for item in ingredients}
+        current = {} if created else {
+            row.ingredients_id: row
+            for row in IngredientForRecipe.objects.filter(recipe=recipe)
+        }
+        deltas = {}
+        removed = current.keys() - amounts.keys()
+        if removed:
+            IngredientForRecipe.objects.filter(
+                recipe=recipe, ingredients__in=removed
+            ).delete()
+            deltas.update({pk: -current[pk].amount for pk in removed})
+        changed = []
+        for ingredient_id, row in current.items():
+            amount = amounts.get(ingredient_id)
+            if amount is not None and row.amount != amount:
+                deltas[ingredient_id] = amount - row.amount
+                row.amount = amount
+                changed.append(row)
+        if changed:
+            IngredientForRecipe.objects.bulk_update(changed, ['amount'])
+        added = [
+            IngredientForRecipe(recipe=recipe, ingredients_id=ingredient_id,
+                                amount=amount)
+            for ingredient_id, amount in amounts.items()
+            if ingredient_id not in current
+        ]
+        if added:
+            IngredientForRecipe.objects.bulk_create(added)
+            deltas.update({row.ingredients_id: row.amount for row in added})
+        if deltas and not created:
+            apply_recipe_change(recipe.pk, deltas)
+
+    @transaction.atomic
     def create(self, request, *args, **kwargs):
         author = self.request.user
         serializer = RecipeSerializerPost(data=request.data)
-        if serializer.is_valid():
-            tags = serializer.validated_data.pop('tags')
-            ingredients = serializer.validated_data.pop('ingredients')
-            value = len(ingredients)
-            recipe = Recipes.objects.create(author=author,
-                                            **serializer.validated_data)
-            self.create_tags(tags, recipe)
-            objs = [IngredientForRecipe(
-                recipe=recipe, ingredients=ingredients[i]['id'],
-                amount=ingredients[i]['amount']) for i in range(
-                value)]
-            IngredientForRecipe.objects.bulk_create(objs)
-            serializer = RecipeSerializerPost(instance=recipe,
-                                              context={'request': request})
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
-
-    def partial_update(self, request, pk=None, *args, **kwargs):
-        instance = get_object_or_404(Recipes, pk=pk)
-        instance.tags.clear()
-        IngredientForRecipe.objects.filter(recipe=instance).delete()
-        serializer = RecipeSerializerPost(instance, data=request.data,
-                                          partial=True)
         serializer.is_valid(raise_exception=True)
         tags = serializer.validated_data.pop('tags')
         ingredients = serializer.validated_data.pop('ingredients')
-        value = len(ingredients)
-        self.create_tags(tags, instance)
-        objs = [IngredientForRecipe(
-            recipe=instance, ingredients=ingredients[i]['id'],
-            amount=ingredients[i]['amount']) for i in range(
-            value)]
-        IngredientForRecipe.objects.bulk_create(objs)
+        recipe = Recipes.objects.create(author=author,
+                                        **serializer.validated_data)
+        recipe.tags.set(tags)
+        self.set_ingredients(recipe, ingredients, created=True)
+        serializer = RecipeSerializerPost(
+            instance=self.get_queryset().get(pk=recipe.pk),
+            context={'request': request}
+        )
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    @transaction.atomic
+    def update(self, request, pk=None, *args, **kwargs):
+        partial = kwargs.pop('partial', False)
+        instance = get_object_or_404(
+            Recipes.objects.select_for_update(), pk=pk
+        )
+        serializer = RecipeSerializerPost(instance, data=request.data,
+                                          partial=partial)
+        serializer.is_valid(raise_exception=True)
+        tags = serializer.validated_data.pop('tags', None)
+        ingredients = serializer.validated_data.pop('ingredients', None)
         serializer.save()
-        serializer = RecipeSerializerPost(instance=instance,
-                                          context={'request': request})
+        if tags is not None:
+            instance.tags.set(tags)
+        if ingredients is not None:
+            self.set_ingredients(instance, ingredients)
+        serializer = RecipeSerializerPost(
+            instance=self.get_queryset().get(pk=instance.pk),
+            context={'request': request}
+        )
         return Response(serializer.data, status=status.HTTP_200_OK)
@@ -1,5 +1,6 @@
 import os
 from decouple import config
+from django.core.exceptions import ImproperlyConfigured
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
@@ -30,6 +31,8 @@ INSTALLED_APPS = [
 STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 
 MIDDLEWARE = [
+    'api.middleware.QueryInstrumentationMiddleware',
+    'api.middleware.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -62,6 +65,14 @@ WSGI_APPLICATION = 'backend.wsgi.application'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+IMAGE_VARIANT_WORKERS = int(os.getenv('IMAGE_VARIANT_WORKERS', default=2))
+
+# Ленты подписок: рецепты авторов, у которых подписчиков не меньше
+# FEED_FANOUT_THRESHOLD, раскладываются по лентам при публикации.
+# 0 отключает раскладку, лента тогда собирается только при чтении.
+FEED_FANOUT_THRESHOLD = int(os.getenv('FEED_FANOUT_THRESHOLD', default=0))
+FEED_TIMELINE_DEPTH = int(os.getenv('FEED_TIMELINE_DEPTH', default=1000))
+
 DATABASES = {
     'default': {
         'ENGINE': os.getenv('DB_ENGINE',
@@ -75,6 +86,63 @@ DATABASES = {
     }
 }
 
+# Реплики для чтения: DB_REPLICA_HOSTS=replica1,replica2. Для локальной
+# проверки можно указать отдельные базы через DB_REPLICA_NAMES.
+REPLICA_HOSTS = [host for host in os.getenv(
+    'DB_REPLICA_HOSTS', default='').split(',') if host]
+REPLICA_NAMES = [name for name in os.getenv(
+    'DB_REPLICA_NAMES', default='').split(',') if name]
+DATABASE_REPLICAS = []
+for index in range(max(len(REPLICA_HOSTS), len(REPLICA_NAMES))):
+    alias = f'replica{index + 1}'
+    DATABASES[alias] = {
+        **DATABASES['default'],
+        'HOST': (REPLICA_HOSTS[index] if index < len(REPLICA_HOSTS)
+                 else DATABASES['default']['HOST']),
+        'NAME': (REPLICA_NAMES[index] if index < len(REPLICA_NAMES)
+                 else DATABASES['default']['NAME']),
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(alias)
+DATABASE_ROUTERS = ['api.replicas.ReplicaRouter']
+# Сколько секунд после записи клиент читает только с основной базы
+REPLICA_STICKY_SECONDS = int(os.getenv('DB_REPLICA_STICKY_SECONDS',
+                                       default=5))
+
+# Версии кэша, LRU токенов и «липкость» реплик общие для всех воркеров и
+# management-команд, поэтому кэш должен быть общим (memcached). LocMemCache
+# живёт внутри процесса и допустим только при DEBUG.
+CACHE_BACKEND = os.getenv(
+    'CACHE_BACKEND',
+    default='django.core.cache.backends.memcached.MemcachedCache')
+if CACHE_BACKEND.endswith('.LocMemCache') and not DEBUG:
+    raise ImproperlyConfigured(
+        'LocMemCache не общий для процессов: задайте CACHE_BACKEND '
+        'с общим кэшем или включите DEBUG')
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKEND,
+        'LOCATION': os.getenv('CACHE_LOCATION', default='127.0.0.1:11211'),
+    }
+}
+
+QUERY_BUDGET_RAISE = os.getenv('QUERY_BUDGET_RAISE', default='') == 'True'
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'api.queries': {
+            'handlers': ['console'],
+            'level': os.getenv('QUERY_LOG_LEVEL', default='INFO'),
+            'propagate': False,
+        },
+    },
+}
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -92,12 +160,25 @@ AUTH_PASSWORD_VALIDATORS = [
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
+    ),
+    'DEFAULT_RENDERER_CLASSES': (
+        'api.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    'DEFAULT_PARSER_CLASSES': (
+        'api.parsers.ORJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
     ),
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 6,
 }
 
+# LRU процесса для токенов: число записей и время жизни в секундах
+TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE', default=10000))
+TOKEN_CACHE_TTL = int(os.getenv('TOKEN_CACHE_TTL', default=300))
+
 DJOSER = {
     'LOGIN_FIELD': 'email',
     'PERMISSIONS': {
@@ -14,3 +14,17 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 
 application = get_wsgi_application()
+
+
+def warm_up():
+    from django.db import DatabaseError
+
+    from api.ingredient_index import ingredient_index
+
+    try:
+        ingredient_index.refresh()
+    except DatabaseError:
+        pass
+
+
+warm_up()
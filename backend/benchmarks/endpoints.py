@@ -0,0 +1,199 @@
+"""Нагрузочный прогон эндпоинтов API с отчётом p50/p95, запросов и RPS.
+
+Данные готовит команда generate_data:
+
+    python manage.py generate_data --users 1000 --recipes 10000
+    python -m benchmarks.endpoints --requests 50 --output run.json
+    python -m benchmarks.endpoints --compare run.json --output run2.json
+
+По умолчанию запросы идут через тестовый клиент Django в этом же процессе,
+тогда считается и число SQL-запросов. С --base-url запросы уходят на
+запущенный сервер, число SQL-запросов в этом режиме не известно.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import time
+from datetime import datetime
+from itertools import combinations
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.db import connection  # noqa: E402
+from django.db.models import Count  # noqa: E402
+from django.test import Client  # noqa: E402
+from django.test.utils import CaptureQueriesContext  # noqa: E402
+from rest_framework.authtoken.models import Token  # noqa: E402
+
+from api.models import Ingredient, Recipes, Tags  # noqa: E402
+from users.models import User  # noqa: E402
+
+FILTERS = ('tags', 'author', 'is_favorited', 'is_in_shopping_cart')
+
+
+def pick_user():
+    """Пользователь с самой большой корзиной и избранным"""
+    return User.objects.annotate(
+        total=Count('favorite', distinct=True) + Count('user', distinct=True)
+    ).order_by('-total').first()
+
+
+def recipe_list_query(names, author, tags):
+    params = []
+    if 'tags' in names:
+        params += [f'tags={slug}' for slug in tags]
+    if 'author' in names:
+        params.append(f'author={author}')
+    if 'is_favorited' in names:
+        params.append('is_favorited=1')
+    if 'is_in_shopping_cart' in names:
+        params.append('is_in_shopping_cart=1')
+    return '&'.join(params)
+
+
+def build_scenarios(user):
+    recipe = Recipes.objects.order_by('-pub_date').first()
+    author = recipe.author_id
+    tags = list(Tags.objects.values_list('slug', flat=True)[:2])
+    prefix = Ingredient.objects.values_list('name', flat=True).first()[:2]
+    scenarios = {}
+    for size in range(len(FILTERS) + 1):
+        for names in combinations(FILTERS, size):
+            query = recipe_list_query(names, author, tags)
+            title = 'recipes[' + (','.join(names) or 'all') + ']'
+            scenarios[title] = f'/api/recipes/?{query}'
+    scenarios['recipes[cursor]'] = '/api/recipes/?pagination=cursor'
+    scenarios['recipe_detail'] = f'/api/recipes/{recipe.pk}/'
+    scenarios['feed'] = '/api/recipes/feed/'
+    scenarios['subscriptions'] = '/api/users/subscriptions/?recipes_limit=3'
+    scenarios['download_shopping_cart'] = (
+        '/api/recipes/download_shopping_cart/'
+    )
+    scenarios['ingredients[search]'] = f'/api/ingredients/?name={prefix}'
+    scenarios['tags'] = '/api/tags/'
+    return scenarios
+
+
+class LocalClient:
+    counts_queries = True
+
+    def __init__(self, token):
+        self.client = Client(HTTP_AUTHORIZATION=f'Token {token}')
+
+    def get(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+            if response.streaming:
+                b''.join(response.streaming_content)
+        return response.status_code, len(context)
+
+
+class RemoteClient:
+    counts_queries = False
+
+    def __init__(self, token, base_url):
+        import requests
+
+        self.session = requests.Session()
+        self.session.headers['Authorization'] = f'Token {token}'
+        self.base_url = base_url.rstrip('/')
+
+    def get(self, url):
+        response = self.session.get(self.base_url + url)
+        return response.status_code, None
+
+
+def percentile(values, share):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(share * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def run_scenario(client, url, requests, warmup):
+    for _ in range(warmup):
+        client.get(url)
+    timings, queries, statuses = [], [], set()
+    started = time.perf_counter()
+    for _ in range(requests):
+        begin = time.perf_counter()
+        status, count = client.get(url)
+        timings.append((time.perf_counter() - begin) * 1000)
+        statuses.add(status)
+        if count is not None:
+            queries.append(count)
+    elapsed = time.perf_counter() - started
+    return {
+        'url': url,
+        'status': sorted(statuses),
+        'p50_ms': round(percentile(timings, 0.5), 3),
+        'p95_ms': round(percentile(timings, 0.95), 3),
+        'mean_ms': round(statistics.mean(timings), 3),
+        'rps': round(requests / elapsed, 1),
+        'queries': max(queries) if queries else None,
+    }
+
+
+def compare(previous, current):
+    print(f'\n{"сценарий":<55}{"p50 было":>10}{"p50 стало":>11}'
+          f'{"запросы":>12}')
+    for name, result in current.items():
+        old = previous.get(name)
+        if old is None:
+            continue
+        print(f'{name:<55}{old["p50_ms"]:>10.2f}{result["p50_ms"]:>11.2f}'
+              f'{str(old["queries"]) + "→" + str(result["queries"]):>12}')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=30)
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--base-url')
+    parser.add_argument('--only', help='Подстрока в названии сценария')
+    parser.add_argument('--output', default='benchmark.json')
+    parser.add_argument('--compare', help='JSON предыдущего прогона')
+    args = parser.parse_args()
+
+    user = pick_user()
+    token, _ = Token.objects.get_or_create(user=user)
+    if args.base_url:
+        client = RemoteClient(token.key, args.base_url)
+    else:
+        client = LocalClient(token.key)
+    results = {}
+    for name, url in build_scenarios(user).items():
+        if args.only and args.only not in name:
+            continue
+        results[name] = run_scenario(client, url, args.requests, args.warmup)
+        result = results[name]
+        print(f'{name:<55} p50 {result["p50_ms"]:>8.2f} мс  '
+              f'p95 {result["p95_ms"]:>8.2f} мс  {result["rps"]:>7} rps  '
+              f'запросов {result["queries"]}  {result["status"]}')
+    report = {
+        'meta': {
+            'started_at': datetime.now().isoformat(),
+            'database': connection.vendor,
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'base_url': args.base_url,
+            'requests': args.requests,
+            'recipes': Recipes.objects.count(),
+            'users': User.objects.count(),
+        },
+        'results': results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as file:
+        json.dump(report, file, ensure_ascii=False, indent=2)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as file:
+            compare(json.load(file)['results'], results)
+
+
+if __name__ == '__main__':
+    main()
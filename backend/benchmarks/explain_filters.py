@@ -0,0 +1,159 @@
+"""Планы запросов FilterRecipe без индексов под фильтры и с ними.
+
+Скрипт наполняет настроенную базу тестовыми данными (если их меньше
+--recipes), временно возвращает схему к состоянию до оптимизаций: удаляет
+индексы Recipes из TUNED_INDEXES и ставит уникальное ограничение
+IngredientForRecipe в старом порядке полей (ingredients, recipe). Затем
+снимает EXPLAIN для каждой комбинации фильтров и для выборки ингредиентов
+страницы, восстанавливает схему и снимает планы ещё раз. На PostgreSQL
+используется EXPLAIN ANALYZE и добавляется фильтр search. Индексы из
+UNTOUCHED_INDEXES остаются на месте. Запускать только на отладочной базе:
+
+    python -m benchmarks.explain_filters --recipes 100000 --output plans.json
+"""
+import argparse
+import io
+import json
+import os
+from itertools import combinations
+from types import SimpleNamespace
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.core.management import call_command  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.db.models import Count, UniqueConstraint  # noqa: E402
+from django.http import QueryDict  # noqa: E402
+
+from api.filter import FilterRecipe  # noqa: E402
+from api.models import IngredientForRecipe, Recipes, Tags  # noqa: E402
+from users.models import User  # noqa: E402
+
+FILTERS = ('tags', 'author', 'is_favorited', 'is_in_shopping_cart')
+# Удаляются только те, что есть в базе (GIN создаётся на PostgreSQL)
+TUNED_INDEXES = ('recipes_pub_date_id_idx', 'recipes_author_pub_date_idx',
+                 'recipes_search_vector_gin')
+# Индекс лент TimelineEntry: FilterRecipe его не читает
+UNTOUCHED_INDEXES = ('timeline_user_pub_date_idx',)
+# Ограничение IngredientForRecipe до перестановки полей
+ORIGINAL_CONSTRAINT = UniqueConstraint(fields=('ingredients', 'recipe'),
+                                       name='unique recipe')
+
+
+def seed(recipes_total, users_total=1000):
+    missing = recipes_total - Recipes.objects.count()
+    if missing > 0:
+        call_command('generate_data', users=users_total, recipes=missing,
+                     stdout=io.StringIO())
+
+
+def filters():
+    if connection.vendor == 'postgresql':
+        return FILTERS + ('search',)
+    return FILTERS
+
+
+def filter_params(names, user, tags):
+    params = {}
+    if 'search' in names:
+        params['search'] = Recipes.objects.values_list(
+            'name', flat=True
+        ).first().split()[0]
+    if 'tags' in names:
+        params['tags'] = tags
+    if 'author' in names:
+        params['author'] = str(user.pk)
+    if 'is_favorited' in names:
+        params['is_favorited'] = 'true'
+    if 'is_in_shopping_cart' in names:
+        params['is_in_shopping_cart'] = 'true'
+    return params
+
+
+def explain_all(page_size):
+    user = User.objects.annotate(
+        total=Count('favorite')
+    ).order_by('-total').first()
+    tags = list(Tags.objects.values_list('slug', flat=True)[:2])
+    request = SimpleNamespace(user=user)
+    options = {'analyze': True} if connection.vendor == 'postgresql' else {}
+    plans = {}
+    names_all = filters()
+    for size in range(len(names_all) + 1):
+        for names in combinations(names_all, size):
+            data = QueryDict(mutable=True)
+            for key, value in filter_params(names, user, tags).items():
+                if isinstance(value, list):
+                    data.setlist(key, value)
+                else:
+                    data[key] = value
+            queryset = FilterRecipe(
+                data, queryset=Recipes.objects.all(), request=request
+            ).qs[:page_size]
+            plans[','.join(names) or 'none'] = queryset.explain(**options)
+    page = list(Recipes.objects.values_list('id', flat=True)[:page_size])
+    plans['ingredients_prefetch'] = IngredientForRecipe.objects.filter(
+        recipe_id__in=page
+    ).select_related('ingredients').explain(**options)
+    return plans
+
+
+def tuned_indexes():
+    """Индексы из TUNED_INDEXES, которые есть в базе"""
+    with connection.cursor() as cursor:
+        existing = connection.introspection.get_constraints(
+            cursor, Recipes._meta.db_table
+        )
+    return [index for index in Recipes._meta.indexes
+            if index.name in TUNED_INDEXES and index.name in existing]
+
+
+def untune(editor):
+    """Возвращает схему к состоянию до оптимизаций"""
+    for index in tuned_indexes():
+        editor.remove_index(Recipes, index)
+    constraint, = IngredientForRecipe._meta.constraints
+    editor.remove_constraint(IngredientForRecipe, constraint)
+    editor.add_constraint(IngredientForRecipe, ORIGINAL_CONSTRAINT)
+
+
+def retune(editor):
+    editor.remove_constraint(IngredientForRecipe, ORIGINAL_CONSTRAINT)
+    constraint, = IngredientForRecipe._meta.constraints
+    editor.add_constraint(IngredientForRecipe, constraint)
+    for index in tuned_indexes():
+        editor.add_index(Recipes, index)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--recipes', type=int, default=100000)
+    parser.add_argument('--page-size', type=int, default=6)
+    parser.add_argument('--output', default='explain_filters.json')
+    args = parser.parse_args()
+
+    seed(args.recipes)
+    print('Остаются на месте:', ', '.join(UNTOUCHED_INDEXES))
+    with connection.schema_editor() as editor:
+        untune(editor)
+    try:
+        before = explain_all(args.page_size)
+    finally:
+        with connection.schema_editor() as editor:
+            retune(editor)
+    after = explain_all(args.page_size)
+    result = {name: {'before': before[name], 'after': after[name]}
+              for name in before}
+    with open(args.output, 'w', encoding='utf-8') as file:
+        json.dump(result, file, ensure_ascii=False, indent=2)
+    for name, plan in result.items():
+        print(f'== {name}\n-- до:\n{plan["before"]}\n-- после:\n'
+              f'{plan["after"]}\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""Сравнение поиска ингредиентов по префиксу: индекс в памяти против БД.
+
+Запуск из каталога backend:
+
+    python -m benchmarks.ingredient_search [--csv ../data/ingredients.csv]
+"""
+import argparse
+import csv
+import io
+import os
+import timeit
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.core.management import call_command  # noqa: E402
+
+from api.ingredient_index import ingredient_index  # noqa: E402
+from api.models import Ingredient  # noqa: E402
+
+DEFAULT_CSV = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__)))),
+    'data', 'ingredients.csv'
+)
+
+
+def load(path):
+    call_command('load_ingredients', path, stdout=io.StringIO())
+    with open(path, encoding='utf-8') as file:
+        return [row[0] for row in csv.reader(file) if row]
+
+
+def db_search(prefix, limit):
+    queryset = Ingredient.objects.filter(name__istartswith=prefix)
+    return list(queryset.values('id', 'name', 'measurement_unit')[:limit])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--csv', default=DEFAULT_CSV)
+    parser.add_argument('--limit', type=int, default=20)
+    parser.add_argument('--number', type=int, default=5)
+    args = parser.parse_args()
+
+    names = load(args.csv)
+    prefixes = sorted({name[:length] for name in names for length in (1, 3)})
+    ingredient_index.refresh()
+    print(f'{Ingredient.objects.count()} ингредиентов, '
+          f'{len(prefixes)} префиксов, limit={args.limit}')
+    for title, search in (('index', ingredient_index.search),
+                          ('db', db_search)):
+        seconds = min(timeit.repeat(
+            lambda: [search(prefix, args.limit) for prefix in prefixes],
+            number=1, repeat=args.number
+        ))
+        print(f'{title:>5}: {seconds / len(prefixes) * 1e6:9.1f} мкс/запрос')
+
+
+if __name__ == '__main__':
+    main()
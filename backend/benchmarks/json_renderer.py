@@ -0,0 +1,85 @@
+"""Сравнение JSONRenderer/JSONParser DRF с ORJSONRenderer/ORJSONParser.
+
+Данные ответов берутся у настоящих эндпоинтов (response.data), поэтому в
+базе должны быть рецепты и ингредиенты:
+
+    python manage.py load_ingredients
+    python manage.py generate_data --users 200 --recipes 2000
+    python -m benchmarks.json_renderer --number 200
+"""
+import argparse
+import io
+import json
+import os
+import timeit
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.test import Client  # noqa: E402
+from rest_framework.authtoken.models import Token  # noqa: E402
+from rest_framework.parsers import JSONParser  # noqa: E402
+from rest_framework.renderers import JSONRenderer  # noqa: E402
+
+from api.models import Recipes  # noqa: E402
+from api.parsers import ORJSONParser  # noqa: E402
+from api.renderers import ORJSONRenderer  # noqa: E402
+from benchmarks.endpoints import pick_user  # noqa: E402
+
+PAYLOADS = {
+    'recipes[limit=6]': '/api/recipes/',
+    'recipes[limit=100]': '/api/recipes/?limit=100',
+    'recipe_detail': '/api/recipes/{recipe}/',
+    'ingredients': '/api/ingredients/',
+    'subscriptions': '/api/users/subscriptions/?limit=100&recipes_limit=3',
+}
+
+
+def collect(client, recipe):
+    payloads = {}
+    for name, url in PAYLOADS.items():
+        response = client.get(url.format(recipe=recipe))
+        if response.status_code == 200:
+            payloads[name] = response.data
+    return payloads
+
+
+def measure(function, number):
+    return min(timeit.repeat(function, number=number, repeat=3)) / number
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--number', type=int, default=100)
+    args = parser.parse_args()
+
+    user = pick_user()
+    token, _ = Token.objects.get_or_create(user=user)
+    client = Client(HTTP_AUTHORIZATION=f'Token {token.key}')
+    recipe = Recipes.objects.order_by('-pub_date').values_list(
+        'id', flat=True
+    ).first()
+    renderers = (JSONRenderer(), ORJSONRenderer())
+    parsers = (JSONParser(), ORJSONParser())
+    print(f'{"ответ":<22}{"байт":>10}{"render drf":>13}{"orjson":>10}'
+          f'{"x":>6}{"parse drf":>12}{"orjson":>10}{"x":>6}')
+    for name, data in collect(client, recipe).items():
+        content = renderers[0].render(data)
+        assert json.loads(content) == json.loads(renderers[1].render(data))
+        render = [measure(lambda: renderer.render(data), args.number)
+                  for renderer in renderers]
+        parse = [measure(lambda: parser.parse(io.BytesIO(content)),
+                         args.number)
+                 for parser in parsers]
+        print(f'{name:<22}{len(content):>10}'
+              f'{render[0] * 1000:>11.3f}мс{render[1] * 1000:>8.3f}мс'
+              f'{render[0] / render[1]:>6.1f}'
+              f'{parse[0] * 1000:>10.3f}мс{parse[1] * 1000:>8.3f}мс'
+              f'{parse[0] / parse[1]:>6.1f}')
+
+
+if __name__ == '__main__':
+    main()
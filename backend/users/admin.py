@@ -1,18 +1,22 @@
 from django.contrib import admin
 
+from api.admin import LargeTableAdmin
 from users.models import User, Follow
 
 
 @admin.register(User)
-class UserAdmin(admin.ModelAdmin):
-    list_display = ('id', 'username', 'email', 'first_name', 'last_name')
+class UserAdmin(LargeTableAdmin):
+    list_display = ('id', 'username', 'email', 'first_name', 'last_name',
+                    'recipes_count', 'followers_count')
     search_fields = ('username', 'email')
-    list_filter = ('username', 'email')
-    empty_value_display = '-пусто-'
+    list_filter = ('is_active', 'is_staff')
 
 
-class FollowAdmin(admin.ModelAdmin):
+class FollowAdmin(LargeTableAdmin):
     list_display = ('user', 'author')
+    list_select_related = ('user', 'author')
+    autocomplete_fields = ('user', 'author')
+    search_fields = ('user__username', 'user__email', 'author__username')
 
 
 admin.site.register(Follow, FollowAdmin)
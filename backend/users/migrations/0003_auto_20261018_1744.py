@@ -0,0 +1,39 @@
+# Generated by Django 2.2.16 on 2026-10-18 17:44
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_counters(apps, schema_editor):
+    User = apps.get_model('users', 'User')
+    for field, related in (
+            ('recipes_count', apps.get_model('api', 'Recipes')),
+            ('followers_count', apps.get_model('users', 'Follow'))):
+        counts = related.objects.filter(author=OuterRef('pk')).order_by(
+        ).values('author').annotate(total=Count('pk')).values('total')
+        User.objects.update(**{field: Coalesce(
+            Subquery(counts, output_field=IntegerField()), 0
+        )})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_auto_20220904_1151'),
+        ('api', '0010_auto_20261018_1744'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='followers_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Подписчиков'),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='recipes_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Рецептов'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
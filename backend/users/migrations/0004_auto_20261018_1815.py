@@ -0,0 +1,18 @@
+# Generated by Django 2.2.16 on 2026-10-18 18:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_auto_20261018_1744'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='feed_fanout',
+            field=models.BooleanField(default=False, editable=False, verbose_name='Рецепты раскладываются по лентам'),
+        ),
+    ]
@@ -2,7 +2,31 @@ from django.contrib.auth.models import AbstractUser
 from django.db import models
 
 
-class User(AbstractUser):
+class DenormalizedFieldsMixin:
+    """Поля из denormalized_fields пишутся только точечными UPDATE
+
+    Это счётчики (F() + 1) и прочие данные, которые ведут сигналы и фоновые
+    задачи. Обычный save() существующей записи их не сохраняет, иначе
+    устаревший экземпляр затёр бы чужие изменения.
+    """
+    denormalized_fields = ()
+
+    def save(self, force_insert=False, force_update=False, using=None,
+             update_fields=None):
+        if update_fields is None and not force_insert \
+                and not self._state.adding:
+            deferred = self.get_deferred_fields()
+            update_fields = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.denormalized_fields
+                and field.attname not in deferred
+            ]
+        super().save(force_insert=force_insert, force_update=force_update,
+                     using=using, update_fields=update_fields)
+
+
+class User(DenormalizedFieldsMixin, AbstractUser):
     username = models.CharField(max_length=150)
     email = models.EmailField(unique=True)
     first_name = models.CharField(max_length=150)
@@ -10,6 +34,16 @@ class User(AbstractUser):
     is_subscribed = models.BooleanField(
         default=False,
         verbose_name='Подписка на пользователя')
+    recipes_count = models.PositiveIntegerField(
+        'Рецептов', default=0, editable=False
+    )
+    followers_count = models.PositiveIntegerField(
+        'Подписчиков', default=0, editable=False
+    )
+    feed_fanout = models.BooleanField(
+        'Рецепты раскладываются по лентам', default=False, editable=False
+    )
+    denormalized_fields = ('recipes_count', 'followers_count', 'feed_fanout')
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username', 'first_name', 'last_name', 'password']
 